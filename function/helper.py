@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 # license plate type classification helper function
 def linear_equation(x1, y1, x2, y2):
@@ -13,52 +14,45 @@ def check_point_linear(x, y, x1, y1, x2, y2):
 
 # detect character and number in license plate
 def read_plate(yolo_license_plate, im):
-    LP_type = "1"
-    results = yolo_license_plate(im)
-    bb_list = results.pandas().xyxy[0].values.tolist()
-    if len(bb_list) == 0 or len(bb_list) < 7 or len(bb_list) > 10:
-        return "unknown"
-    center_list = []
-    y_mean = 0
-    y_sum = 0
-    for bb in bb_list:
-        x_c = (bb[0]+bb[2])/2
-        y_c = (bb[1]+bb[3])/2
-        y_sum += y_c
-        center_list.append([x_c,y_c,bb[-1]])
+    # raw=True returns the NMS arrays (x1, y1, x2, y2, conf, cls) without building DataFrames
+    chars = yolo_license_plate(im, raw=True)[0]
+    license_plate, _ = decode_plate(chars, yolo_license_plate.names)
+    return license_plate
+
+# detect characters of several plate crops with one forward pass
+# returns [(plate string, per-character confidences), ...]
+def read_plate_batch(yolo_license_plate, ims):
+    if len(ims) == 0:
+        return []
+    preds = yolo_license_plate(list(ims), raw=True)
+    return [decode_plate(chars, yolo_license_plate.names) for chars in preds]
 
-    # find 2 point to draw line
-    l_point = center_list[0]
-    r_point = center_list[0]
-    for cp in center_list:
-        if cp[0] < l_point[0]:
-            l_point = cp
-        if cp[0] > r_point[0]:
-            r_point = cp
-    for ct in center_list:
-        if l_point[0] != r_point[0]:
-            if (check_point_linear(ct[0], ct[1], l_point[0], l_point[1], r_point[0], r_point[1]) == False):
-                LP_type = "2"
+# arrange detected characters (N, 6) [x1, y1, x2, y2, conf, cls] into the plate string
+def decode_plate(chars, names, line_tol=3):
+    chars = np.asarray(chars, dtype=np.float32).reshape(-1, 6)
+    if len(chars) < 7 or len(chars) > 10:
+        return "unknown", []
+    x_c = (chars[:, 0] + chars[:, 2]) / 2
+    y_c = (chars[:, 1] + chars[:, 3]) / 2
 
-    y_mean = int(int(y_sum) / len(bb_list))
-    size = results.pandas().s
+    # 1 line plates and 2 line plates: least-squares line through all centers,
+    # a center further than line_tol pixels from it means a second row
+    LP_type = "1"
+    if np.ptp(x_c) > 0:
+        a, b = np.polyfit(x_c, y_c, 1)
+        if np.abs(y_c - (a * x_c + b)).max() > line_tol:
+            LP_type = "2"
 
-    # 1 line plates and 2 line plates
-    line_1 = []
-    line_2 = []
-    license_plate = ""
     if LP_type == "2":
-        for c in center_list:
-            if int(c[1]) > y_mean:
-                line_2.append(c)
-            else:
-                line_1.append(c)
-        for l1 in sorted(line_1, key = lambda x: x[0]):
-            license_plate += str(l1[2])
-        license_plate += "-"
-        for l2 in sorted(line_2, key = lambda x: x[0]):
-            license_plate += str(l2[2])
+        is_line_2 = y_c > y_c.mean()
+        line_1 = np.flatnonzero(~is_line_2)
+        line_2 = np.flatnonzero(is_line_2)
+        lines = [line_1[np.argsort(x_c[line_1], kind="stable")],
+                 line_2[np.argsort(x_c[line_2], kind="stable")]]
     else:
-        for l in sorted(center_list, key = lambda x: x[0]):
-            license_plate += str(l[2])
-    return license_plate
\ No newline at end of file
+        lines = [np.argsort(x_c, kind="stable")]
+
+    labels = [str(names[int(c)]) for c in chars[:, 5]]
+    license_plate = "-".join("".join(labels[i] for i in line) for line in lines)
+    confs = chars[np.concatenate(lines), 4].tolist()
+    return license_plate, confs
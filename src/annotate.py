@@ -2,10 +2,21 @@
 Annotate video with detection results
 """
 import cv2
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import os
 
 
+def draw_detections(frame, detections: List[Tuple[float, float, float, float, str, bool]]):
+    """Vẽ box + text của các detection lên frame (in-place)"""
+    for (x1, y1, x2, y2, text, is_matched) in detections:
+        color = (36, 255, 12) if is_matched else (255, 0, 0)
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+        if text:
+            cv2.putText(frame, text, (int(x1), max(0, int(y1) - 10)), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return frame
+
+
 def annotate_video_with_detections(
     video_path: str,
     output_path: str,
@@ -37,12 +48,7 @@ def annotate_video_with_detections(
             
             # Annotate frame if has detections
             if frame_idx in detections:
-                for (x1, y1, x2, y2, text, is_matched) in detections[frame_idx]:
-                    color = (36, 255, 12) if is_matched else (255, 0, 0)
-                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
-                    if text:
-                        cv2.putText(frame, text, (int(x1), max(0, int(y1) - 10)), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+                draw_detections(frame, detections[frame_idx])
             
             writer.write(frame)
             frame_idx += 1
@@ -51,3 +57,63 @@ def annotate_video_with_detections(
     finally:
         cap.release()
 
+
+def annotate_segment(
+    video_path: str,
+    output_path: str,
+    detections: Dict[int, List[Tuple[float, float, float, float, str, bool]]],
+    fps: float,
+    start_time: float,
+    end_time: float,
+    frame_step: int = 1
+) -> Optional[str]:
+    """
+    Annotate only [start_time, end_time] of a video (seek thẳng tới đoạn cần vẽ)
+    
+    Box của frame được phân tích được giữ cho các frame bị skip ngay sau nó.
+    
+    Args:
+        video_path: Path to original video
+        output_path: Path to save the annotated clip
+        detections: Dict mapping frame_idx to list of (x1, y1, x2, y2, text, is_matched)
+        fps: Video FPS
+        start_time, end_time: Window to render, in seconds
+        frame_step: Distance between analysed frames
+        
+    Returns:
+        output_path, or None if no frame could be read
+    """
+    fps = fps if fps and fps > 0 else 25.0
+    frame_step = max(1, int(frame_step))
+    start_frame = max(0, int(round(start_time * fps)))
+    end_frame = int(round(end_time * fps))
+    cap = cv2.VideoCapture(video_path)
+    writer = None
+    written = 0
+    try:
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        # Detection gần nhất trước start_frame (carry forward vào frame đầu tiên)
+        current, current_idx = [], None
+        for k in range(start_frame, max(-1, start_frame - frame_step), -1):
+            if k in detections:
+                current, current_idx = detections[k], k
+                break
+        for frame_idx in range(start_frame, end_frame + 1):
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if frame_idx in detections:
+                current, current_idx = detections[frame_idx], frame_idx
+            elif current_idx is not None and frame_idx - current_idx >= frame_step:
+                current, current_idx = [], None
+            if writer is None:
+                height, width = frame.shape[:2]
+                writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            writer.write(draw_detections(frame, current))
+            written += 1
+    finally:
+        if writer is not None:
+            writer.release()
+        cap.release()
+    return output_path if written else None
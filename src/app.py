@@ -1,76 +1,229 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, Form, Request
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 from fastapi.responses import StreamingResponse
 import os
+import shutil
 import uuid
-from typing import List
 from fastapi import WebSocket, WebSocketDisconnect
 import asyncio
 from anyio import to_thread
 import json
 
-from .service import run_job, get_cancellation_flag, cancel_job, clear_cancellation_flag
+from .jobs import QueueFullError, get_job_manager
+from .plate_search import get_plate_index
+from .service import (
+    run_job, run_watchlist_job, run_index_job, parse_plate_list, load_config, cancel_job, dedupe_upload
+)
+from .uploads import UploadTooLarge, receive_uploads, upload_settings
 
 
 app = FastAPI(title='VJTS API')
 
+CONFIG_PATH = 'config/config.yaml'
+jobs = get_job_manager(load_config(CONFIG_PATH))
+
+
+def _ffmpeg_path():
+    return os.path.join(os.getcwd(), 'ffmpeg.exe') if os.path.exists('ffmpeg.exe') else None
+
+
+def _submit(fn, kwargs, priority: int = 0, kind: str = 'job', extra=None):
+    """Đưa job vào JobManager, trả về 202 + job_id ngay (429 nếu hàng đợi đầy)"""
+    try:
+        job_id = jobs.submit(fn, kwargs, priority=priority, kind=kind)
+    except QueueFullError as e:
+        return JSONResponse({'error': 'queue_full', 'message': str(e)}, status_code=429)
+    return JSONResponse({'job_id': job_id, 'status': 'queued', **(extra or {})}, status_code=202)
+
 
 @app.post('/jobs')
-async def create_job(plate: str = Form(...), video_dir: str = Form('data/videos'), output_dir: str = Form('data/outputs')):
-    res = run_job(
-        plate=plate,
-        video_dir=video_dir,
-        output_dir=output_dir,
-        config_path='config/config.yaml',
-        annotate=True,
-        ffmpeg_path=os.path.join(os.getcwd(), 'ffmpeg.exe') if os.path.exists('ffmpeg.exe') else None,
-        db_path='db/vjts.sqlite',
-    )
-    return JSONResponse(res)
+async def create_job(plate: str = Form(...), video_dir: str = Form('data/videos'), output_dir: str = Form('data/outputs'),
+                     max_appearances: int | None = Form(None), first_per_camera: bool | None = Form(None),
+                     priority: int = Form(0)):
+    return _submit(run_job, {
+        'plate': plate,
+        'video_dir': video_dir,
+        'output_dir': output_dir,
+        'config_path': CONFIG_PATH,
+        'annotate': True,
+        'ffmpeg_path': _ffmpeg_path(),
+        'db_path': 'db/vjts.sqlite',
+        'max_appearances': max_appearances,
+        'first_per_camera': first_per_camera,
+    }, priority=priority, kind='search')
 
 
-@app.post('/upload_run')
-async def upload_and_run(
-    plate: str = Form(...),
-    files: List[UploadFile] = File(...),
-    output_dir: str = Form('data/outputs')
-):
+@app.post('/watchlist_jobs')
+async def create_watchlist_job(plates: str = Form(...), video_dir: str = Form('data/videos'), output_dir: str = Form('data/outputs'),
+                               priority: int = Form(0)):
+    """Search many plates (comma/newline separated) with one pass over the videos"""
+    watchlist = parse_plate_list(plates)
+    if not watchlist:
+        return JSONResponse({'error': 'empty watchlist'}, status_code=400)
+    return _submit(run_watchlist_job, {
+        'plates': watchlist,
+        'video_dir': video_dir,
+        'output_dir': output_dir,
+        'config_path': CONFIG_PATH,
+        'annotate': True,
+        'ffmpeg_path': _ffmpeg_path(),
+        'db_path': 'db/vjts.sqlite',
+    }, priority=priority, kind='watchlist')
+
+
+@app.post('/index')
+async def create_index_job(video_dir: str = Form('data/videos'), priority: int = Form(10)):
+    """Quét trước thư mục video vào index để các lần tìm kiếm sau không decode lại"""
+    return _submit(run_index_job, {
+        'video_dir': video_dir,
+        'config_path': CONFIG_PATH,
+        'db_path': 'db/vjts.sqlite',
+    }, priority=priority, kind='index')
+
+
+@app.get('/jobs')
+async def list_jobs():
+    return JSONResponse({'jobs': jobs.list_jobs()})
+
+
+@app.get('/jobs/{job_id}')
+async def get_job(job_id: str):
+    """Trạng thái + kết quả của job (client poll endpoint này)"""
+    info = jobs.get(job_id)
+    if info is None:
+        return JSONResponse({'error': 'not found'}, status_code=404)
+    return JSONResponse(info)
+
+
+@app.get('/jobs/{job_id}/events')
+async def get_job_events(job_id: str, after: int = 0):
+    """Event của job có seq > after; SSE client dùng /jobs/{job_id}/stream"""
+    if jobs.get(job_id) is None:
+        return JSONResponse({'error': 'not found'}, status_code=404)
+    return JSONResponse({'job_id': job_id, 'events': jobs.events(job_id, after)})
+
+
+@app.get('/jobs/{job_id}/stream')
+async def stream_job_events(job_id: str, after: int = 0):
+    """Subscribe event của job (Server-Sent Events) tới khi job kết thúc"""
+    if jobs.get(job_id) is None:
+        return JSONResponse({'error': 'not found'}, status_code=404)
+
+    async def gen():
+        last = after
+        while True:
+            for evt in jobs.events(job_id, last):
+                last = evt['seq']
+                yield f"data: {json.dumps(evt)}\n\n"
+            info = jobs.get(job_id)
+            if info is None or info['status'] not in ('queued', 'running'):
+                if info is not None:
+                    yield f"event: result\ndata: {json.dumps(info)}\n\n"
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(gen(), media_type='text/event-stream')
+
+
+async def _dedupe_file(info):
+    """File upload trùng nội dung với video đã có: ghi lại bản gốc vào info['duplicate_of']"""
+    duplicate_of = await to_thread.run_sync(dedupe_upload, info['path'], 'db/vjts.sqlite', CONFIG_PATH, info.get('sha1'))
+    if duplicate_of:
+        info['duplicate_of'] = duplicate_of
+
+
+async def _receive_upload(request: Request, on_file=None):
+    """
+    Stream body multipart của request xuống data/videos/uploads/<id> theo section upload của config
+
+    Returns:
+        (upload_dir, fields, files) hoặc JSONResponse lỗi (400 / 413)
+    """
+    up = upload_settings(load_config(CONFIG_PATH))
     job_uuid = uuid.uuid4().hex[:12]
-    upload_dir = os.path.join('data', 'videos', 'uploads', job_uuid)
+    upload_dir = os.path.join(up['dir'], job_uuid)
     os.makedirs(upload_dir, exist_ok=True)
-    saved = []
-    for uf in files:
-        dest = os.path.join(upload_dir, uf.filename)
-        with open(dest, 'wb') as f:
-            f.write(await uf.read())
-        saved.append(dest)
-
-    res = run_job(
-        plate=plate,
-        video_dir=upload_dir,
-        output_dir=output_dir,
-        config_path='config/config.yaml',
-        annotate=True,
-        ffmpeg_path=os.path.join(os.getcwd(), 'ffmpeg.exe') if os.path.exists('ffmpeg.exe') else None,
-        db_path='db/vjts.sqlite',
-    )
-    res['uploaded'] = saved
-    return JSONResponse(res)
+    try:
+        fields, files = await receive_uploads(
+            request.stream(), request.headers.get('content-type', ''), upload_dir,
+            chunk_size=up['chunk_size'], hash_name=up['hash'],
+            max_file_size=up['max_file_size'], max_total_size=up['max_total_size'],
+            on_file=on_file,
+        )
+    except (UploadTooLarge, ValueError) as e:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        status = 413 if isinstance(e, UploadTooLarge) else 400
+        return JSONResponse({'error': 'upload_failed', 'message': str(e)}, status_code=status)
+    return upload_dir, fields, files
+
+
+@app.post('/upload_run')
+async def upload_and_run(request: Request):
+    """
+    Upload video (multipart: plate, files, output_dir?, priority?) rồi chạy search trên thư mục upload
+
+    Khi index bật và upload.analyze_on_arrival: mỗi file vừa ghi xong được đưa vào hàng đợi
+    index ngay, nên việc quét bắt đầu trong lúc các file sau vẫn đang upload; job search
+    cuối cùng đọc lại reads từ index thay vì decode lại.
+    """
+    cfg = load_config(CONFIG_PATH)
+    pre_index = upload_settings(cfg)['analyze_on_arrival'] and bool((cfg.get('index', {}) or {}).get('enabled'))
+    index_jobs = []
+
+    async def on_file(info):
+        await _dedupe_file(info)
+        if not pre_index:
+            return
+        try:
+            index_jobs.append(jobs.submit(run_index_job, {
+                'video_dir': os.path.dirname(info['path']),
+                'video_paths': [info['path']],
+                'config_path': CONFIG_PATH,
+                'db_path': 'db/vjts.sqlite',
+            }, kind='index'))
+        except QueueFullError:
+            pass  # Job search sẽ tự quét file này
+
+    received = await _receive_upload(request, on_file)
+    if isinstance(received, JSONResponse):
+        for job_id in index_jobs:
+            jobs.cancel(job_id)
+        return received
+    upload_dir, fields, files = received
+    if not fields.get('plate'):
+        for job_id in index_jobs:
+            jobs.cancel(job_id)
+        return JSONResponse({'error': 'plate is required'}, status_code=400)
+
+    return _submit(run_job, {
+        'plate': fields['plate'],
+        'video_dir': upload_dir,
+        'output_dir': fields.get('output_dir') or 'data/outputs',
+        'config_path': CONFIG_PATH,
+        'annotate': True,
+        'ffmpeg_path': _ffmpeg_path(),
+        'db_path': 'db/vjts.sqlite',
+    }, priority=int(fields.get('priority') or 0), kind='search',
+        extra={'uploaded': [f['path'] for f in files], 'files': files, 'index_jobs': index_jobs})
 
 @app.post('/upload')
-async def upload_only(files: List[UploadFile] = File(...)):
-    job_uuid = uuid.uuid4().hex[:12]
-    upload_dir = os.path.join('data', 'videos', 'uploads', job_uuid)
-    os.makedirs(upload_dir, exist_ok=True)
-    saved = []
-    for uf in files:
-        dest = os.path.join(upload_dir, uf.filename)
-        with open(dest, 'wb') as f:
-            f.write(await uf.read())
-        saved.append(dest)
-    return JSONResponse({'upload_dir': upload_dir, 'saved': saved})
+async def upload_only(request: Request):
+    received = await _receive_upload(request, _dedupe_file)
+    if isinstance(received, JSONResponse):
+        return received
+    upload_dir, _, files = received
+    return JSONResponse({'upload_dir': upload_dir, 'saved': [f['path'] for f in files], 'files': files})
+
+
+async def _wait_job(job_id: str, interval: float = 0.5):
+    """Chờ job kết thúc mà không chặn event loop"""
+    while True:
+        info = jobs.get(job_id)
+        if info is None or info['status'] not in ('queued', 'running'):
+            return info
+        await asyncio.sleep(interval)
 
 
 @app.websocket('/ws')
@@ -91,21 +244,18 @@ async def ws_progress(ws: WebSocket):
         def on_crop(buf: bytes):
             loop.call_soon_threadsafe(asyncio.create_task, ws.send_bytes(buf))
 
-        async def run_blocking():
-            return await to_thread.run_sync(
-                run_job,
-                plate,
-                video_dir,
-                output_dir,
-                'config/config.yaml',
-                True,
-                os.path.join(os.getcwd(), 'ffmpeg.exe') if os.path.exists('ffmpeg.exe') else None,
-                'db/vjts.sqlite',
-                on_event,
-                on_crop,
-            )
-
-        res = await run_blocking()
+        job_id = jobs.submit(run_job, {
+            'plate': plate,
+            'video_dir': video_dir,
+            'output_dir': output_dir,
+            'config_path': CONFIG_PATH,
+            'annotate': True,
+            'ffmpeg_path': _ffmpeg_path(),
+            'db_path': 'db/vjts.sqlite',
+        }, kind='search', on_event=on_event, on_crop=on_crop)
+        info = await _wait_job(job_id)
+        res = info['result'] if info['status'] in ('done', 'cancelled') and info['result'] else \
+            {'error': info['status'], 'message': info['error']}
         await ws.send_json({'type': 'result', **res})
     except WebSocketDisconnect:
         pass
@@ -122,12 +272,12 @@ async def ws_progress(ws: WebSocket):
 
 
 @app.get('/events')
-async def sse_events(plate: str, video_dir: str = 'data/videos', output_dir: str = 'data/outputs'):
+async def sse_events(plate: str, video_dir: str = 'data/videos', output_dir: str = 'data/outputs',
+                     max_appearances: int | None = None, first_per_camera: bool | None = None):
     queue: asyncio.Queue = asyncio.Queue()
     
     # Generate job_id for cancellation
     job_id = f"JOB-{uuid.uuid4().hex[:12]}"
-    cancellation_flag = get_cancellation_flag(job_id)
 
     def on_event(evt):
         try:
@@ -147,20 +297,24 @@ async def sse_events(plate: str, video_dir: str = 'data/videos', output_dir: str
         # Send job_id to client
         yield f"event: job_id\ndata: {json.dumps({'job_id': job_id})}\n\n"
         
-        loop = asyncio.get_running_loop()
-        task = loop.create_task(to_thread.run_sync(
-            run_job,
-            plate,
-            video_dir,
-            output_dir,
-            'config/config.yaml',
-            True,
-            os.path.join(os.getcwd(), 'ffmpeg.exe') if os.path.exists('ffmpeg.exe') else None,
-            'db/vjts.sqlite',
-            on_event,
-            on_crop,
-            cancellation_flag,  # Pass cancellation flag
-        ))
+        try:
+            jobs.submit(run_job, {
+                'plate': plate,
+                'video_dir': video_dir,
+                'output_dir': output_dir,
+                'config_path': CONFIG_PATH,
+                'annotate': True,
+                'ffmpeg_path': _ffmpeg_path(),
+                'db_path': 'db/vjts.sqlite',
+                'max_appearances': max_appearances,
+                'first_per_camera': first_per_camera,
+            }, kind='search', on_event=on_event, on_crop=on_crop, job_id=job_id)
+        except QueueFullError as e:
+            yield f"event: result\ndata: {json.dumps({'error': 'queue_full', 'message': str(e)})}\n\n"
+            return
+        info = jobs.get(job_id)
+        if info and info['status'] == 'queued':
+            yield f"data: {json.dumps({'type': 'queued', 'position': info.get('queue_position')})}\n\n"
         try:
             while True:
                 try:
@@ -175,22 +329,21 @@ async def sse_events(plate: str, video_dir: str = 'data/videos', output_dir: str
                     elif item['type'] == 'crop':
                         yield f"event: crop\ndata: {item['payload']}\n\n"
                 except asyncio.TimeoutError:
-                    if task.done():
-                        try:
-                            res = task.result()
-                            # Check if cancelled
-                            if res.get('error') == 'cancelled':
-                                yield f"event: cancelled\ndata: {json.dumps(res)}\n\n"
-                            else:
-                                yield f"event: result\ndata: {json.dumps(res)}\n\n"
-                        except Exception as e:
-                            err = {'error': 'job_failed', 'message': str(e)}
+                    info = jobs.get(job_id)
+                    if info is None or info['status'] not in ('queued', 'running'):
+                        res = (info or {}).get('result')
+                        if info and info['status'] == 'cancelled':
+                            yield f"event: cancelled\ndata: {json.dumps(res or {'error': 'cancelled'})}\n\n"
+                        elif info and info['status'] == 'done':
+                            yield f"event: result\ndata: {json.dumps(res)}\n\n"
+                        else:
+                            err = {'error': 'job_failed', 'message': (info or {}).get('error')}
                             yield f"event: result\ndata: {json.dumps(err)}\n\n"
                         break
         finally:
-            if not task.done():
-                task.cancel()
-            clear_cancellation_flag(job_id)
+            info = jobs.get(job_id)
+            if info and info['status'] == 'queued':
+                jobs.cancel(job_id)  # Client đã ngắt trước khi job được chạy
 
     return StreamingResponse(gen(), media_type='text/event-stream')
 
@@ -202,10 +355,17 @@ async def download_result(path: str):
     return FileResponse(path)
 
 
+@app.get('/plates/search')
+async def search_plates(q: str, max_distance: int = 2, limit: int = 50):
+    """Tìm các biển số đã từng đọc được trong khoảng cách Levenshtein <= max_distance"""
+    index = await to_thread.run_sync(get_plate_index, 'db/vjts.sqlite')
+    return JSONResponse({'query': q, 'results': index.search(q, max_distance, limit)})
+
+
 @app.post('/cancel')
 async def cancel_job_endpoint(job_id: str = Form(...)):
     """Cancel a running job"""
-    success = cancel_job(job_id)
+    success = jobs.cancel(job_id) or cancel_job(job_id)
     if success:
         return JSONResponse({'status': 'cancelled', 'message': f'Job {job_id} đã được hủy'})
     else:
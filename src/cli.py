@@ -8,10 +8,10 @@ import yaml
 
 from .detector import LicensePlateDetector
 from .ocr import OcrEngine
-from .matcher import is_match, normalize
+from .matcher import PlateMatcher, normalize
 from .videoio import iterate_frames, get_video_info
 from .segmenter import SegmentAccumulator
-from .concat import concat_segments
+from .concat import concat_segments, merge_segments
 from .db import init_db, Video as DbVideo, Appearance as DbAppearance
 
 
@@ -91,6 +91,7 @@ def main():
     session = Session()
 
     segments = []
+    plate_matcher = PlateMatcher(args.plate, match_mode, max_dist)
 
     for root, _, files in os.walk(video_dir):
         for name in files:
@@ -120,7 +121,7 @@ def main():
                 for (x1, y1, x2, y2, score) in boxes:
                     roi = frame[int(y1):int(y2), int(x1):int(x2)]
                     text = ocr_engine.read_text(roi)
-                    is_matched_box = text and is_match(args.plate, text, match_mode, max_dist)
+                    is_matched_box = text and plate_matcher(text)
                     if args.annotate:
                         import cv2
                         color = (36, 255, 12) if is_matched_box else (255, 0, 0)
@@ -172,7 +173,11 @@ def main():
     try:
         output_video_path = os.path.join(output_dir, f'VJTS_{norm_plate}_{timestamp}.mp4')
         if segments:
-            concat_segments(segments, output_video_path, ffmpeg_path=args.ffmpeg or None)
+            concat_cfg = cfg.get('concat', {}) or {}
+            merge_gap = float((cfg.get('trim', {}) or {}).get('merge_gap', 0.0) or 0.0)
+            concat_segments(merge_segments(segments, merge_gap), output_video_path, ffmpeg_path=args.ffmpeg or None,
+                            mode=concat_cfg.get('mode', 'accurate'), max_workers=concat_cfg.get('max_workers'),
+                            threads_per_ffmpeg=concat_cfg.get('threads_per_ffmpeg'))
             print(f'Concatenated result saved to: {output_video_path}')
         else:
             print('No segments matched, skipping concat.')
@@ -1,39 +1,254 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import os
 import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+CONCAT_MODES = ('accurate', 'copy', 'smart')
 
 
 def _is_exe(path: str) -> bool:
     return os.path.isfile(path) and os.access(path, os.X_OK)
 
 
-def concat_segments_ffmpeg(segments: List[Dict], output_path: str, ffmpeg_path: str = 'ffmpeg'):
+def _segment_source(s: Dict):
+    """(input path, start, end) của một segment; end None = tới hết file (clip annotated đã cắt sẵn)"""
+    if s.get('clip_path'):
+        return s['clip_path'], 0.0, None
+    return s['video_path'], max(0.0, float(s['start_time'])), float(s['end_time'])
+
+
+def merge_segments(segments: List[Dict], max_gap: float = 0.0) -> List[Dict]:
+    """
+    Gộp các segment chồng lấn hoặc cách nhau <= max_gap giây trong cùng một video
+    
+    Segment có clip_path (clip annotated đã cắt sẵn) chỉ gộp với segment dùng cùng clip.
+    Thứ tự video giữ như đầu vào, trong mỗi video sắp theo start_time.
+    
+    Returns:
+        Merged segments (video_path, start_time, end_time, clip_path nếu có) với
+        'sources' = chỉ số các segment gốc và 'appearance_ids' nếu segment gốc có appearance_id
+    """
+    groups: Dict[str, List[int]] = {}
+    for i, s in enumerate(segments):
+        groups.setdefault(s['video_path'], []).append(i)
+
+    merged = []
+    for indices in groups.values():
+        indices.sort(key=lambda i: float(segments[i]['start_time']))
+        current = None
+        for i in indices:
+            s = segments[i]
+            start, end = float(s['start_time']), float(s['end_time'])
+            clip_path = s.get('clip_path')
+            if current is not None and current.get('clip_path') == clip_path and (
+                    clip_path or start - current['end_time'] <= max_gap):
+                current['end_time'] = max(current['end_time'], end)
+                current['sources'].append(i)
+                continue
+            current = {'video_path': s['video_path'], 'start_time': start, 'end_time': end, 'sources': [i]}
+            if clip_path:
+                current['clip_path'] = clip_path
+            merged.append(current)
+    for m in merged:
+        ids = [segments[i]['appearance_id'] for i in m['sources'] if segments[i].get('appearance_id') is not None]
+        if ids:
+            m['appearance_ids'] = ids
+    return merged
+
+
+def _ffprobe_path(ffmpeg_path: str) -> str:
+    """ffprobe nằm cạnh ffmpeg (ffmpeg.exe -> ffprobe.exe), mặc định lấy từ PATH"""
+    if ffmpeg_path == 'ffmpeg':
+        return 'ffprobe'
+    folder, name = os.path.split(ffmpeg_path)
+    return os.path.join(folder, name.replace('ffmpeg', 'ffprobe'))
+
+
+STREAM_FIELDS = ('codec_name', 'profile', 'level', 'pix_fmt', 'width', 'height', 'time_base', 'r_frame_rate')
+
+
+def _probe_stream(ffprobe_path: str, path: str) -> Optional[Dict[str, str]]:
+    """Các tham số của video stream đầu tiên quyết định concat -c copy có ghép được hay không"""
+    try:
+        out = subprocess.run([ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+                              '-show_entries', 'stream=' + ','.join(STREAM_FIELDS), '-of', 'default=nw=1', path],
+                             check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    info = {}
+    for line in out.splitlines():
+        key, _, value = line.strip().partition('=')
+        if key in STREAM_FIELDS:
+            info[key] = value
+    return info if all(info.get(k) for k in STREAM_FIELDS) else None
+
+
+def _x264_match_args(info: Dict[str, str]) -> Optional[List[str]]:
+    """
+    Tham số libx264 để part re-encode cùng profile / level / pix_fmt / timescale với part copy,
+    None nếu stream nguồn không encode lại được cho khớp
+    """
+    profile = {'constrained baseline': 'baseline', 'baseline': 'baseline',
+               'main': 'main', 'high': 'high'}.get(info['profile'].lower())
+    try:
+        level = int(info['level'])
+        timescale = int(info['time_base'].split('/')[1])
+    except (ValueError, IndexError):
+        return None
+    if info['codec_name'] != 'h264' or info['pix_fmt'] != 'yuv420p' or profile is None or level <= 0:
+        return None
+    return ['-profile:v', profile, '-level', f'{level / 10:.1f}', '-video_track_timescale', str(timescale)]
+
+
+def _resolve_mode(ffmpeg_path: str, segments: List[Dict], mode: str) -> Tuple[str, Optional[List[str]]]:
+    """
+    Mode thực sự dùng cho cả lần concat: copy / smart chỉ khi mọi nguồn (kể cả clip annotated,
+    camera khác) cùng codec, profile, level, pix_fmt, độ phân giải, time_base và fps, ngược lại accurate
+
+    Returns:
+        (mode, extra libx264 args cho part re-encode trong mode smart)
+    """
+    if mode == 'accurate':
+        return mode, None
+    ffprobe_path = _ffprobe_path(ffmpeg_path)
+    infos = [_probe_stream(ffprobe_path, path) for path in {_segment_source(s)[0] for s in segments}]
+    if not infos or any(info is None or info != infos[0] for info in infos):
+        print(f"⚠️ concat mode '{mode}': nguồn không cùng tham số stream, dùng accurate")
+        return 'accurate', None
+    if infos[0]['codec_name'] != 'h264':
+        return 'accurate', None
+    if mode == 'smart':
+        match_args = _x264_match_args(infos[0])
+        if match_args is None:
+            print("⚠️ concat mode 'smart': không encode lại khớp được stream nguồn, dùng accurate")
+            return 'accurate', None
+        return mode, match_args
+    return mode, None
+
+
+def _probe_keyframes(ffprobe_path: str, path: str, start: float, end: float, margin: float = 10.0) -> List[float]:
+    """Thời điểm (giây) các keyframe quanh [start, end], chỉ đọc packet trong khoảng đó"""
+    interval = f'{max(0.0, start - margin):.3f}%{end + margin:.3f}'
+    try:
+        out = subprocess.run([ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+                              '-read_intervals', interval,
+                              '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path],
+                             check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    keyframes = []
+    for line in out.splitlines():
+        parts = line.strip().split(',')
+        if len(parts) >= 2 and 'K' in parts[1]:
+            try:
+                keyframes.append(float(parts[0]))
+            except ValueError:
+                continue
+    return sorted(set(keyframes))
+
+
+def _encode_cmd(ffmpeg_path: str, in_path: str, start: float, end: Optional[float], out_path: str,
+                threads: int = 0, extra_args: Optional[List[str]] = None) -> List[str]:
+    # -ss trước -i: seek phía input (nhảy tới keyframe rồi decode tới đúng start), không decode từ đầu file
+    cmd = [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error']
+    if start > 0:
+        cmd += ['-ss', f'{start:.3f}']
+    cmd += ['-i', in_path]
+    if end is not None:
+        cmd += ['-t', f'{max(0.0, end - start):.3f}']
+    cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p', '-an']
+    cmd += extra_args or []
+    if threads:
+        cmd += ['-threads', str(threads)]  # Chia core cho các ffmpeg chạy song song
+    return cmd + [out_path]
+
+
+def _copy_cmd(ffmpeg_path: str, in_path: str, start: float, end: float, out_path: str) -> List[str]:
+    return [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', f'{start:.6f}', '-i', in_path, '-t', f'{max(0.0, end - start):.6f}',
+            '-c', 'copy', '-an', '-avoid_negative_ts', 'make_zero', out_path]
+
+
+def _trim_segment(ffmpeg_path: str, s: Dict, part_prefix: str, mode: str, threads: int = 0,
+                  match_args: Optional[List[str]] = None) -> List[str]:
+    """
+    Cắt một segment thành một hoặc nhiều part (theo thứ tự phát)
+    
+    Args:
+        mode: 'accurate' - re-encode cả đoạn (seek phía input)
+              'copy' - lùi start về keyframe gần nhất và stream-copy (không re-encode, có thể dài hơn một chút)
+              'smart' - re-encode phần GOP dở ở hai đầu, stream-copy các GOP nguyên ở giữa
+              (mode đã qua _resolve_mode: mọi nguồn cùng tham số stream)
+        threads: -threads của mỗi lần re-encode (0 = để ffmpeg tự chọn)
+        match_args: Tham số libx264 cho part re-encode của mode smart (khớp với part copy)
+    """
+    in_path, start, end = _segment_source(s)
+    cmds: List[Tuple[List[str], str]] = []
+    if mode != 'accurate' and end is not None:
+        keyframes = _probe_keyframes(_ffprobe_path(ffmpeg_path), in_path, start, end)
+        if keyframes and mode == 'copy':
+            snapped = max([k for k in keyframes if k <= start + 1e-3] or [keyframes[0]])
+            cmds.append((_copy_cmd(ffmpeg_path, in_path, snapped, end, f'{part_prefix}_c.mp4'), f'{part_prefix}_c.mp4'))
+        elif keyframes:
+            inner = [k for k in keyframes if start - 1e-3 <= k <= end + 1e-3]
+            if len(inner) >= 2:
+                k1, k2 = inner[0], inner[-1]
+                if k1 - start > 1e-3:
+                    cmds.append((_encode_cmd(ffmpeg_path, in_path, start, k1, f'{part_prefix}_a.mp4', threads, match_args),
+                                 f'{part_prefix}_a.mp4'))
+                cmds.append((_copy_cmd(ffmpeg_path, in_path, k1, k2, f'{part_prefix}_b.mp4'), f'{part_prefix}_b.mp4'))
+                if end - k2 > 1e-3:
+                    cmds.append((_encode_cmd(ffmpeg_path, in_path, k2, end, f'{part_prefix}_c.mp4', threads, match_args),
+                                 f'{part_prefix}_c.mp4'))
+    if not cmds:
+        # accurate, clip annotated, không probe được keyframe hoặc đoạn ngắn hơn một GOP
+        cmds.append((_encode_cmd(ffmpeg_path, in_path, start, end, f'{part_prefix}.mp4', threads, match_args),
+                     f'{part_prefix}.mp4'))
+    for cmd, _ in cmds:
+        subprocess.run(cmd, check=True)
+    return [p for _, p in cmds]
+
+
+def concat_segments_ffmpeg(segments: List[Dict], output_path: str, ffmpeg_path: str = 'ffmpeg',
+                           mode: str = 'accurate', max_workers: Optional[int] = None,
+                           threads_per_ffmpeg: Optional[int] = None):
+    """
+    Trim every segment (in parallel) and join the parts with the concat demuxer
+    
+    Args:
+        mode: One of CONCAT_MODES, see _trim_segment
+        max_workers: Max number of ffmpeg processes trimming at the same time
+            (None = half the CPU cores)
+        threads_per_ffmpeg: Encoder threads of each ffmpeg (None = CPU cores / workers)
+    """
     if not (_is_exe(ffmpeg_path) or ffmpeg_path == 'ffmpeg'):
         raise RuntimeError(f"ffmpeg not found at {ffmpeg_path}")
+    if mode not in CONCAT_MODES:
+        raise ValueError(f"Unknown concat mode: {mode}")
     if not segments:
         return
+    mode, match_args = _resolve_mode(ffmpeg_path, segments, mode)
 
     with tempfile.TemporaryDirectory() as tmpdir:
-        part_paths = []
-        for idx, s in enumerate(segments):
-            start = max(0.0, float(s['start_time']))
-            end = float(s['end_time'])
-            in_path = s['video_path']
-            part = os.path.join(tmpdir, f'part_{idx:04d}.mp4')
-            # Re-encode for accurate trim
-            # Đặt -i trước -ss để đảm bảo seek chính xác hơn
-            cmd = [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
-                   '-i', in_path,
-                   '-ss', f'{start:.3f}', '-to', f'{end:.3f}',
-                   '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-an', part]
-            subprocess.run(cmd, check=True)
-            part_paths.append(part)
+        cpus = os.cpu_count() or 2
+        workers = max(1, min(len(segments), max_workers or max(1, cpus // 2)))
+        threads = max(1, int(threads_per_ffmpeg or cpus // workers))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map giữ đúng thứ tự segment; lỗi của một ffmpeg được raise lại ở đây
+            parts_per_segment = list(pool.map(
+                lambda item: _trim_segment(ffmpeg_path, item[1], os.path.join(tmpdir, f'part_{item[0]:04d}'), mode, threads,
+                                           match_args),
+                enumerate(segments),
+            ))
+        part_paths = [p for parts in parts_per_segment for p in parts]
 
         list_file = os.path.join(tmpdir, 'parts.txt')
         with open(list_file, 'w', encoding='utf-8') as f:
             for p in part_paths:
-                f.write(f"file '{p.replace('\\', '/')}'\n")
+                posix_path = p.replace('\\', '/')
+                f.write(f"file '{posix_path}'\n")
 
         cmd_concat = [ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
                       '-f', 'concat', '-safe', '0', '-i', list_file,
@@ -41,30 +256,45 @@ def concat_segments_ffmpeg(segments: List[Dict], output_path: str, ffmpeg_path:
         subprocess.run(cmd_concat, check=True)
 
 
-def concat_segments(segments: List[Dict], output_path: str, ffmpeg_path: str | None = None):
-    # Prefer ffmpeg if available
-    if ffmpeg_path and (_is_exe(ffmpeg_path) or ffmpeg_path == 'ffmpeg'):
-        return concat_segments_ffmpeg(segments, output_path, ffmpeg_path)
-
+def concat_segments_moviepy(segments: List[Dict], output_path: str, fps: float = 25):
+    """
+    Fallback không có ffmpeg: ghi frame của từng segment lần lượt vào một writer,
+    mỗi lúc chỉ mở một VideoFileClip
+    """
     try:
-        from moviepy.editor import VideoFileClip, concatenate_videoclips
+        from moviepy.editor import VideoFileClip
+        from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
     except Exception as e:
         raise RuntimeError(f"moviepy not available and no ffmpeg provided: {e}")
 
-    clips = []
-    for s in segments:
-        start = max(0, s['start_time'])
-        end = s['end_time']
-        clip = VideoFileClip(s['video_path']).subclip(start, end)
-        clips.append(clip)
-
-    if not clips:
-        return
-
-    result = concatenate_videoclips(clips, method='compose')
-    result.write_videofile(output_path, codec='libx264', audio=False, fps=25)
-    for c in clips:
-        c.close()
-    result.close()
+    writer = None
+    size = None
+    try:
+        for s in segments:
+            in_path, start, end = _segment_source(s)
+            clip = VideoFileClip(in_path, audio=False)
+            try:
+                part = clip.subclip(start, end) if end is not None else clip
+                if writer is None:
+                    size = tuple(part.size)
+                    writer = FFMPEG_VideoWriter(output_path, size, fps, codec='libx264')
+                elif tuple(part.size) != size:
+                    part = part.resize(newsize=size)  # Camera khác độ phân giải
+                for frame in part.iter_frames(fps=fps):
+                    writer.write_frame(frame)
+            finally:
+                clip.close()
+    finally:
+        if writer is not None:
+            writer.close()
 
 
+def concat_segments(segments: List[Dict], output_path: str, ffmpeg_path: str | None = None,
+                    mode: str = 'accurate', max_workers: Optional[int] = None,
+                    threads_per_ffmpeg: Optional[int] = None):
+    # Prefer ffmpeg if available
+    if ffmpeg_path and (_is_exe(ffmpeg_path) or ffmpeg_path == 'ffmpeg'):
+        return concat_segments_ffmpeg(segments, output_path, ffmpeg_path, mode=mode, max_workers=max_workers,
+                                      threads_per_ffmpeg=threads_per_ffmpeg)
+    if segments:
+        concat_segments_moviepy(segments, output_path)
@@ -5,7 +5,7 @@ from datetime import datetime
 from typing import Optional
 
 from sqlalchemy import (
-    create_engine, Column, Integer, String, Float, DateTime, Text, UniqueConstraint, ForeignKey, inspect, text
+    create_engine, event, Column, Integer, String, Float, DateTime, Text, UniqueConstraint, ForeignKey, inspect, text
 )
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
@@ -27,6 +27,8 @@ class Video(Base):
     video_id = Column(Integer, primary_key=True, autoincrement=True)
     camera_id = Column(String, ForeignKey('cameras.camera_id'))
     path = Column(Text, unique=True, nullable=False)
+    content_hash = Column(String, index=True)  # size + hash các block mẫu (xem read_index.content_fingerprint)
+    sha1 = Column(String)  # SHA1 toàn bộ file (tính lúc upload), để xác nhận trùng trước khi dedup
     start_ts = Column(DateTime)
     end_ts = Column(DateTime)
     fps = Column(Float)
@@ -38,9 +40,9 @@ class Video(Base):
 class Appearance(Base):
     __tablename__ = 'appearances'
     appearance_id = Column(Integer, primary_key=True, autoincrement=True)
-    plate = Column(String, nullable=False)
+    plate = Column(String, nullable=False, index=True)
     camera_id = Column(String)
-    video_id = Column(Integer, ForeignKey('videos.video_id'))
+    video_id = Column(Integer, ForeignKey('videos.video_id'), index=True)
     start_time = Column(Float, nullable=False)
     end_time = Column(Float, nullable=False)
     score_lp = Column(Float)
@@ -55,6 +57,38 @@ class Appearance(Base):
     video = relationship('Video', back_populates='appearances')
 
 
+class PlateRead(Base):
+    """Một lần OCR một box biển số trong một frame (index để tìm lại không cần decode video)"""
+    __tablename__ = 'plate_reads'
+    read_id = Column(Integer, primary_key=True, autoincrement=True)
+    video_id = Column(Integer, ForeignKey('videos.video_id'), nullable=False, index=True)
+    frame_idx = Column(Integer, nullable=False)
+    x1 = Column(Float)
+    y1 = Column(Float)
+    x2 = Column(Float)
+    y2 = Column(Float)
+    text = Column(String)  # None nếu OCR không đọc được
+    score_lp = Column(Float)  # Confidence của detector
+    score_ocr = Column(Float)  # Confidence trung bình các ký tự
+    char_confs = Column(Text)  # JSON list confidence từng ký tự
+    generation = Column(String)  # Lần quét đã ghi read; chỉ generation trong video_index là hợp lệ
+
+
+class VideoIndex(Base):
+    """Trạng thái index của một video: index còn mới khi mtime/size và index_key không đổi"""
+    __tablename__ = 'video_index'
+    video_id = Column(Integer, ForeignKey('videos.video_id'), primary_key=True)
+    mtime = Column(Float, nullable=False)
+    size = Column(Integer, nullable=False)
+    content_hash = Column(String)  # Fingerprint nội dung lúc index (copy khác path vẫn dùng được)
+    index_key = Column(String, nullable=False)  # model hash + tham số ảnh hưởng tới reads
+    frame_step = Column(Integer, nullable=False)  # Khoảng cách giữa các frame đã phân tích
+    last_frame_idx = Column(Integer, nullable=False)
+    reads_count = Column(Integer)
+    indexed_at = Column(DateTime)
+    generation = Column(String)  # generation của plate_reads thuộc index này (None = DB cũ)
+
+
 class Job(Base):
     __tablename__ = 'jobs'
     job_id = Column(String, primary_key=True)
@@ -66,9 +100,22 @@ class Job(Base):
     segments_json = Column(Text)
 
 
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL: reader không chặn writer (API đọc trong lúc job ghi reads / appearances)
+    # synchronous=NORMAL là đủ an toàn với WAL và nhanh hơn nhiều so với FULL mặc định
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=10000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
 def get_engine(db_path: str) -> any:
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    return create_engine(f'sqlite:///{db_path}', future=True)
+    engine = create_engine(f'sqlite:///{db_path}', future=True)
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
 
 
 def migrate_appearances_table(engine):
@@ -93,6 +140,41 @@ def migrate_appearances_table(engine):
                 print(f"✅ Column '{col_name}' added successfully")
 
 
+def migrate_video_tables(engine):
+    """Thêm các cột mới của videos / video_index / plate_reads vào DB cũ"""
+    new_columns = {
+        'videos': {'content_hash': 'TEXT', 'sha1': 'TEXT'},
+        'video_index': {'content_hash': 'TEXT', 'generation': 'TEXT'},
+        'plate_reads': {'generation': 'TEXT'},
+    }
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    with engine.connect() as conn:
+        for table, table_columns in new_columns.items():
+            if table not in tables:
+                continue
+            columns = [col['name'] for col in inspector.get_columns(table)]
+            for col_name, col_type in table_columns.items():
+                if col_name not in columns:
+                    print(f"📊 Adding column '{col_name}' to {table} table...")
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}"))
+                    conn.commit()
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_videos_content_hash ON videos (content_hash)"))
+        conn.commit()
+
+
+def migrate_indexes(engine):
+    """Tạo index cho các cột hay được lọc (DB cũ được tạo trước khi khai báo index=True)"""
+    indexes = {
+        'ix_appearances_plate': 'appearances (plate)',
+        'ix_appearances_video_id': 'appearances (video_id)',
+    }
+    with engine.connect() as conn:
+        for name, target in indexes.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+        conn.commit()
+
+
 def init_db(db_path: str) -> sessionmaker:
     engine = get_engine(db_path)
     
@@ -103,6 +185,8 @@ def init_db(db_path: str) -> sessionmaker:
     inspector = inspect(engine)
     if 'appearances' in inspector.get_table_names():
         migrate_appearances_table(engine)
+    migrate_video_tables(engine)
+    migrate_indexes(engine)
     
     return sessionmaker(bind=engine, expire_on_commit=False)
 
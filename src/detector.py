@@ -5,6 +5,8 @@ from .gpu_optimizer import get_device, get_gpu_info
 
 
 class LicensePlateDetector:
+    model_path = 'model/LP_detector.pt'
+
     def __init__(self, conf_threshold: float = 0.35, device: Optional[str] = None, use_gpu: bool = True):
         """
         Initialize License Plate Detector
@@ -26,7 +28,7 @@ class LicensePlateDetector:
             self.model = torch.hub.load(
                 'yolov5', 
                 'custom', 
-                path='model/LP_detector.pt', 
+                path=self.model_path, 
                 force_reload=False, 
                 source='local',
                 device=device
@@ -53,7 +55,7 @@ class LicensePlateDetector:
                 self.model = torch.hub.load(
                     'yolov5', 
                     'custom', 
-                    path='model/LP_detector.pt', 
+                    path=self.model_path, 
                     force_reload=False, 
                     source='local',
                     device=device
@@ -63,6 +65,11 @@ class LicensePlateDetector:
             else:
                 raise
 
+    @staticmethod
+    def _to_boxes(pred) -> List[tuple]:
+        """Convert one (n, 6) NMS array [x1, y1, x2, y2, conf, cls] to (x1, y1, x2, y2, confidence) tuples"""
+        return [(float(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4])) for r in pred.tolist()]
+
     def detect(self, frame):
         """
         Detect license plates in a single frame
@@ -74,25 +81,15 @@ class LicensePlateDetector:
             List of (x1, y1, x2, y2, confidence) tuples
         """
         try:
-            results = self.model(frame, size=640)
-            rows = results.pandas().xyxy[0].values.tolist()
-            boxes = []
-            for r in rows:
-                x1, y1, x2, y2, conf = float(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4])
-                boxes.append((x1, y1, x2, y2, conf))
-            return boxes
+            preds = self.model(frame, size=640, raw=True)
+            return self._to_boxes(preds[0])
         except RuntimeError as e:
             if 'out of memory' in str(e).lower():
                 print(f"⚠️ GPU OOM during detection, clearing cache and retrying...")
                 torch.cuda.empty_cache()
                 # Retry once
-                results = self.model(frame, size=640)
-                rows = results.pandas().xyxy[0].values.tolist()
-                boxes = []
-                for r in rows:
-                    x1, y1, x2, y2, conf = float(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4])
-                    boxes.append((x1, y1, x2, y2, conf))
-                return boxes
+                preds = self.model(frame, size=640, raw=True)
+                return self._to_boxes(preds[0])
             raise
 
     def detect_batch(self, frames: List) -> List[List]:
@@ -109,20 +106,9 @@ class LicensePlateDetector:
             return []
         
         try:
-            # YOLOv5 automatically handles batch processing
-            results = self.model(frames, size=640)
-            
-            # Parse results for each frame in batch
-            all_boxes = []
-            for i in range(len(frames)):
-                rows = results.pandas().xyxy[i].values.tolist()
-                boxes = []
-                for r in rows:
-                    x1, y1, x2, y2, conf = float(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4])
-                    boxes.append((x1, y1, x2, y2, conf))
-                all_boxes.append(boxes)
-            
-            return all_boxes
+            # YOLOv5 automatically handles batch processing, raw=True skips Detections.pandas()
+            preds = self.model(frames, size=640, raw=True)
+            return [self._to_boxes(pred) for pred in preds]
         except RuntimeError as e:
             if 'out of memory' in str(e).lower():
                 print(f"⚠️ GPU OOM during batch detection, clearing cache...")
@@ -135,5 +121,3 @@ class LicensePlateDetector:
                     all_boxes.append(boxes)
                 return all_boxes
             raise
-
-
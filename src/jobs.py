@@ -0,0 +1,199 @@
+"""
+Job manager: nhận job (run_job / run_watchlist_job ...) và chạy trên một pool worker
+có giới hạn, hàng đợi ưu tiên (FIFO trong cùng mức ưu tiên), để API trả job id ngay
+"""
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from .service import get_cancellation_flag, clear_cancellation_flag
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class JobManager:
+    def __init__(self, max_concurrent: int = 1, max_queued: int = 100, keep_finished: int = 200,
+                 max_events: int = 500):
+        """
+        Args:
+            max_concurrent: Số job chạy cùng lúc (số worker thread)
+            max_queued: Số job chờ tối đa, vượt quá thì submit báo QueueFullError
+            keep_finished: Số job đã xong giữ lại để client còn poll kết quả
+            max_events: Số event gần nhất giữ lại cho mỗi job
+        """
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queued = max(1, int(max_queued))
+        self.keep_finished = max(1, int(keep_finished))
+        self.max_events = max(1, int(max_events))
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished: deque = deque()
+        self._heap: List[tuple] = []  # (priority, seq, job_id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._workers = [
+            threading.Thread(target=self._work, name=f'vjts-job-{i}', daemon=True)
+            for i in range(self.max_concurrent)
+        ]
+        for t in self._workers:
+            t.start()
+
+    def submit(self, fn: Callable[..., Dict[str, Any]], kwargs: Optional[Dict[str, Any]] = None,
+               priority: int = 0, kind: str = 'job',
+               on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+               on_crop: Optional[Callable[[bytes], None]] = None,
+               job_id: Optional[str] = None) -> str:
+        """
+        Đưa job vào hàng đợi
+
+        Args:
+            fn: Called as fn(**kwargs, on_event=..., on_crop=..., cancellation_flag=...)
+            priority: Số nhỏ chạy trước; cùng priority thì theo thứ tự submit
+            kind: Loại job (để hiển thị)
+            on_event, on_crop: Listener thêm (ví dụ SSE stream), ngoài event lưu trong job
+
+        Returns:
+            job_id
+        """
+        job_id = job_id or f"JOB-{uuid.uuid4().hex[:12]}"
+        with self._cond:
+            if len(self._heap) >= self.max_queued:
+                raise QueueFullError(f'Hàng đợi đã đầy ({self.max_queued} job)')
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'priority': int(priority),
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'events': deque(maxlen=self.max_events),
+                'event_seq': 0,
+                '_fn': fn,
+                '_kwargs': dict(kwargs or {}),
+                '_on_event': on_event,
+                '_on_crop': on_crop,
+            }
+            heapq.heappush(self._heap, (int(priority), next(self._seq), job_id))
+            # Tạo flag ngay để /cancel hủy được cả job đang chờ
+            get_cancellation_flag(job_id)
+            self._cond.notify()
+        return job_id
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs[job_id]
+                flag = get_cancellation_flag(job_id)
+                if flag.is_set():
+                    self._finish(job, 'cancelled', error='cancelled')
+                    clear_cancellation_flag(job_id)
+                    continue
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+
+            def on_event(evt, job=job):
+                self._add_event(job, evt)
+                if job['_on_event']:
+                    job['_on_event'](evt)
+
+            try:
+                result = job['_fn'](**job['_kwargs'], on_event=on_event, on_crop=job['_on_crop'],
+                                    cancellation_flag=flag)
+                with self._cond:
+                    if isinstance(result, dict) and result.get('error') == 'cancelled':
+                        self._finish(job, 'cancelled', result=result, error='cancelled')
+                    else:
+                        self._finish(job, 'done', result=result)
+            except Exception as e:
+                with self._cond:
+                    self._finish(job, 'failed', error=str(e))
+            finally:
+                clear_cancellation_flag(job_id)
+
+    def _add_event(self, job: Dict[str, Any], evt: Dict[str, Any]):
+        with self._cond:
+            job['event_seq'] += 1
+            job['events'].append((job['event_seq'], evt))
+
+    def _finish(self, job: Dict[str, Any], status: str, result: Any = None, error: Optional[str] = None):
+        # Gọi khi đang giữ self._cond
+        job['status'] = status
+        job['result'] = result
+        job['error'] = error
+        job['finished_at'] = time.time()
+        for k in ('_fn', '_kwargs', '_on_event', '_on_crop'):
+            job[k] = None
+        self._finished.append(job['job_id'])
+        while len(self._finished) > self.keep_finished:
+            self._jobs.pop(self._finished.popleft(), None)
+        self._cond.notify_all()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Trạng thái job (không gồm events), None nếu không có"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            info = {k: v for k, v in job.items() if not k.startswith('_') and k != 'events'}
+            if job['status'] == 'queued':
+                ahead = sorted(self._heap)
+                info['queue_position'] = next((i for i, (_, _, jid) in enumerate(ahead) if jid == job_id), None)
+            return info
+
+    def events(self, job_id: str, after: int = 0) -> List[Dict[str, Any]]:
+        """Các event có seq > after (để client poll tiếp từ seq cuối đã nhận)"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return []
+            return [{'seq': seq, **evt} for seq, evt in job['events'] if seq > after]
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            job_ids = list(self._jobs)
+        return [info for info in (self.get(j) for j in job_ids) if info is not None]
+
+    def cancel(self, job_id: str) -> bool:
+        """Hủy job đang chờ hoặc đang chạy"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] not in ('queued', 'running'):
+                return False
+            if job['status'] == 'queued':
+                # Chưa chạy: bỏ khỏi hàng đợi luôn
+                self._heap = [item for item in self._heap if item[2] != job_id]
+                heapq.heapify(self._heap)
+                self._finish(job, 'cancelled', error='cancelled')
+                clear_cancellation_flag(job_id)
+                return True
+            get_cancellation_flag(job_id).set()
+            return True
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(cfg: Optional[Dict[str, Any]] = None) -> JobManager:
+    """JobManager dùng chung của process, tạo lần đầu theo section jobs của config"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            jobs_cfg = (cfg or {}).get('jobs', {}) or {}
+            _manager = JobManager(
+                max_concurrent=jobs_cfg.get('max_concurrent', 1),
+                max_queued=jobs_cfg.get('max_queued', 100),
+                keep_finished=jobs_cfg.get('keep_finished', 200),
+            )
+        return _manager
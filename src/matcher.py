@@ -1,4 +1,5 @@
 import re
+from typing import List
 
 
 def normalize(s: str) -> str:
@@ -29,11 +30,92 @@ def levenshtein(a: str, b: str) -> int:
     return dp[-1]
 
 
+def levenshtein_bounded(a: str, b: str, max_distance: int) -> int:
+    """
+    Levenshtein distance limited to max_distance (Ukkonen band)
+    
+    Only the diagonal band |i - j| <= max_distance is filled and the scan stops as
+    soon as a whole row exceeds max_distance. Returns max_distance + 1 whenever the
+    real distance is larger.
+    """
+    k = max(0, int(max_distance))
+    if a == b:
+        return 0
+    n, m = len(a), len(b)
+    big = k + 1
+    if abs(n - m) > k:
+        return big
+    if n == 0 or m == 0:
+        return max(n, m)
+    prev = [j if j <= k else big for j in range(m + 1)]
+    for i in range(1, n + 1):
+        lo = max(1, i - k)
+        hi = min(m, i + k)
+        cur = [big] * (m + 1)
+        cur[0] = i if i <= k else big
+        row_min = cur[0]
+        ca = a[i - 1]
+        for j in range(lo, hi + 1):
+            v = prev[j - 1] if ca == b[j - 1] else prev[j - 1] + 1
+            if prev[j] + 1 < v:
+                v = prev[j] + 1
+            if cur[j - 1] + 1 < v:
+                v = cur[j - 1] + 1
+            if v > big:
+                v = big
+            cur[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min > k:
+            return big
+        prev = cur
+    return prev[m]
+
+
+class PlateMatcher:
+    """Matcher cho một biển số đích: normalize target một lần, loại nhanh theo độ dài"""
+
+    def __init__(self, plate_target: str, mode: str = 'relaxed', max_distance: int = 2):
+        self.plate = plate_target
+        self.target = normalize(plate_target)
+        self.mode = mode
+        self.max_distance = 0 if mode == 'exact' else max(0, int(max_distance))
+        self.min_len = len(self.target) - self.max_distance
+        self.max_len = len(self.target) + self.max_distance
+
+    def match_normalized(self, text: str) -> bool:
+        """Match một chuỗi đã normalize"""
+        if not (self.min_len <= len(text) <= self.max_len):
+            return False
+        if self.max_distance == 0:
+            return text == self.target
+        return levenshtein_bounded(self.target, text, self.max_distance) <= self.max_distance
+
+    def __call__(self, ocr_text: str) -> bool:
+        return self.match_normalized(normalize(ocr_text))
+
+    def match_many(self, texts: List[str]) -> List[bool]:
+        return [bool(t) and self.match_normalized(normalize(t)) for t in texts]
+
+
+def match_many(matchers: List[PlateMatcher], texts: List[str]) -> List[List[bool]]:
+    """
+    Match a list of OCR reads against several targets at once
+    
+    Each text is normalized once. Returns one row of booleans per text, in the
+    order of matchers.
+    """
+    rows = []
+    for t in texts:
+        if not t:
+            rows.append([False] * len(matchers))
+            continue
+        nt = normalize(t)
+        rows.append([m.match_normalized(nt) for m in matchers])
+    return rows
+
+
 def is_match(plate_target: str, ocr_text: str, mode: str = 'relaxed', max_distance: int = 2) -> bool:
-    a = normalize(plate_target)
-    b = normalize(ocr_text)
-    if mode == 'exact':
-        return a == b
-    return levenshtein(a, b) <= max_distance
+    return PlateMatcher(plate_target, mode, max_distance)(ocr_text)
 
 
@@ -0,0 +1,175 @@
+"""
+Model pool dùng chung trong process: load detector + OCR một lần, giữ sẵn (đã warm-up)
+cho các job sau, và tự load lại khi file .pt thay đổi (mtime / size)
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .detector import LicensePlateDetector
+from .ocr import OcrEngine
+
+
+OCR_CONF = 0.60
+
+
+def _weights_signature() -> Tuple:
+    """(mtime, size) của các file weights; đổi khi file .pt được thay"""
+    sig = []
+    for path in (LicensePlateDetector.model_path, OcrEngine.model_path):
+        try:
+            st = os.stat(path)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+class ModelPool:
+    def __init__(self, size: int = 1, warmup: bool = True):
+        """
+        Args:
+            size: Số cặp detector + OCR tối đa được load (mỗi job đang chạy giữ một cặp)
+            warmup: Chạy một lần inference giả ngay sau khi load
+        """
+        self.size = max(1, int(size))
+        self.warmup = bool(warmup)
+        self._idle: List[Dict[str, Any]] = []
+        self._loaded = 0  # Số cặp đang tồn tại (idle + đang cho mượn + đang load)
+        self._cond = threading.Condition()
+        self.loads = 0
+        self.reloads = 0
+
+    def _load(self, use_gpu: bool, signature: Tuple) -> Dict[str, Any]:
+        detector = LicensePlateDetector(use_gpu=use_gpu)
+        ocr = OcrEngine(conf_threshold=OCR_CONF, use_gpu=use_gpu)
+        if self.warmup:
+            try:
+                # Lần forward đầu chậm (cudnn autotune, cấp phát bộ nhớ) -> trả trước khi có job
+                detector.detect_batch([np.zeros((320, 320, 3), dtype=np.uint8)])
+                ocr.read_text_batch_with_conf([np.zeros((64, 128, 3), dtype=np.uint8)])
+            except Exception as e:
+                print(f"⚠️ Model warm-up failed: {e}")
+        return {'detector': detector, 'ocr': ocr, 'use_gpu': use_gpu, 'signature': signature}
+
+    def acquire(self, use_gpu: bool, conf: float) -> Dict[str, Any]:
+        """
+        Mượn một cặp model (chờ nếu pool đã đầy và mọi cặp đang bận)
+
+        Args:
+            use_gpu: Thiết bị mong muốn; cặp idle khác thiết bị bị thay
+            conf: Ngưỡng detector cho job này (đặt lại trên model, không cần load lại)
+
+        Returns:
+            {'detector', 'ocr', ...}; trả lại bằng release()
+        """
+        signature = _weights_signature()
+        with self._cond:
+            while True:
+                # Bỏ các cặp idle đã cũ (weights đổi trên đĩa)
+                stale = [m for m in self._idle if m['signature'] != signature]
+                if stale:
+                    self._idle = [m for m in self._idle if m['signature'] == signature]
+                    self._loaded -= len(stale)
+                    self.reloads += len(stale)
+                    print(f"🔄 Model weights changed, reloading ({len(stale)} cached instance(s) dropped)")
+                match = next((m for m in self._idle if m['use_gpu'] == use_gpu), None)
+                if match is not None:
+                    self._idle.remove(match)
+                    break
+                if self._loaded < self.size or self._idle:
+                    if self._loaded >= self.size:
+                        # Pool đầy nhưng có cặp idle khác thiết bị -> thay bằng cặp mới
+                        self._idle.pop(0)
+                        self._loaded -= 1
+                    self._loaded += 1
+                    match = None
+                    break
+                self._cond.wait()
+
+        if match is None:
+            try:
+                match = self._load(use_gpu, signature)
+            except BaseException:
+                with self._cond:
+                    self._loaded -= 1
+                    self._cond.notify()
+                raise
+            self.loads += 1
+        match['detector'].model.conf = conf
+        return match
+
+    def release(self, models: Dict[str, Any]):
+        """Trả cặp model về pool (bỏ luôn nếu weights đã đổi trong lúc job chạy)"""
+        with self._cond:
+            if models['signature'] == _weights_signature():
+                self._idle.append(models)
+            else:
+                self._loaded -= 1
+                self.reloads += 1
+            self._cond.notify()
+
+    def lease(self, use_gpu: bool, conf: float) -> 'ModelLease':
+        return ModelLease(self, use_gpu, conf)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                'size': self.size,
+                'loaded': self._loaded,
+                'idle': len(self._idle),
+                'loads': self.loads,
+                'reloads': self.reloads,
+            }
+
+
+class ModelLease:
+    """
+    Lấy model từ pool lần đầu được gọi (lazy) và giữ đến khi release()
+
+    Gọi lease() -> (detector, ocr_engine); dùng được như get_models của service
+    """
+
+    def __init__(self, pool: ModelPool, use_gpu: bool, conf: float):
+        self.pool = pool
+        self.use_gpu = use_gpu
+        self.conf = conf
+        self._models: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> Tuple[LicensePlateDetector, OcrEngine]:
+        with self._lock:
+            if self._models is None:
+                self._models = self.pool.acquire(self.use_gpu, self.conf)
+            return self._models['detector'], self._models['ocr']
+
+    def release(self):
+        with self._lock:
+            if self._models is not None:
+                self.pool.release(self._models)
+                self._models = None
+
+    def __enter__(self) -> 'ModelLease':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_pool: Optional[ModelPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_model_pool(size: int = 1, warmup: bool = True) -> ModelPool:
+    """ModelPool dùng chung của process, tạo lần đầu; size chỉ được tăng về sau"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ModelPool(size=size, warmup=warmup)
+        elif int(size) > _pool.size:
+            with _pool._cond:
+                _pool.size = int(size)
+                _pool._cond.notify_all()
+        return _pool
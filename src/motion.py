@@ -0,0 +1,104 @@
+"""
+Motion gate: bước lọc rẻ trước detector, chỉ chuyển frame có chuyển động sang detect
+(frame differencing trên ảnh thu nhỏ hoặc background subtraction, có thể giới hạn trong ROI)
+"""
+import cv2
+import numpy as np
+from typing import Dict, Optional, Sequence
+
+
+class MotionGate:
+    def __init__(self,
+                 method: str = 'diff',
+                 scale_width: int = 160,
+                 roi: Optional[Sequence[float]] = None,
+                 pixel_threshold: int = 25,
+                 min_changed_ratio: float = 0.002,
+                 max_gap: int = 50):
+        """
+        Args:
+            method: 'diff' (so với frame cuối cùng đã detect) hoặc 'mog2' (background subtraction)
+            scale_width: Chiều rộng ảnh thu nhỏ dùng để so sánh
+            roi: (x1, y1, x2, y2) theo tỉ lệ 0-1 của frame; None = cả frame
+            pixel_threshold: Chênh lệch mức xám để coi một pixel là thay đổi
+            min_changed_ratio: Tỉ lệ pixel thay đổi tối thiểu để coi là có chuyển động
+            max_gap: Sau bấy nhiêu frame bị gate liên tiếp thì vẫn ép detect một lần
+        """
+        self.method = method
+        self.scale_width = max(16, int(scale_width))
+        self.roi = tuple(roi) if roi else None
+        self.pixel_threshold = int(pixel_threshold)
+        self.min_changed_ratio = float(min_changed_ratio)
+        self.max_gap = max(1, int(max_gap))
+        self.reference = None
+        self.gap = 0
+        self.active_frames = 0
+        self.gated_frames = 0
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(detectShadows=False) if method == 'mog2' else None
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict]) -> Optional['MotionGate']:
+        """Tạo gate từ section motion_gate của config, None nếu tắt"""
+        if not cfg or not cfg.get('enabled'):
+            return None
+        return cls(
+            method=cfg.get('method', 'diff'),
+            scale_width=cfg.get('scale_width', 160),
+            roi=cfg.get('roi'),
+            pixel_threshold=cfg.get('pixel_threshold', 25),
+            min_changed_ratio=cfg.get('min_changed_ratio', 0.002),
+            max_gap=cfg.get('max_gap', 50),
+        )
+
+    def signature(self) -> str:
+        """Các tham số quyết định frame nào được detect (đưa vào index key)"""
+        roi = ','.join(f'{float(v):g}' for v in self.roi) if self.roi else 'full'
+        return (f'gate={self.method}:{self.scale_width}:{roi}:{self.pixel_threshold}:'
+                f'{self.min_changed_ratio:g}:{self.max_gap}')
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        if self.roi:
+            x1, y1, x2, y2 = self.roi
+            frame = frame[int(y1 * h):int(y2 * h), int(x1 * w):int(x2 * w)]
+            h, w = frame.shape[:2]
+        scale = self.scale_width / max(1, w)
+        small = cv2.resize(frame, (self.scale_width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def is_active(self, frame: np.ndarray) -> bool:
+        """True nếu frame cần được đưa qua detector"""
+        small = self._prepare(frame)
+        if self._subtractor is not None:
+            mask = self._subtractor.apply(small)
+            changed = np.count_nonzero(mask) / mask.size
+            active = changed >= self.min_changed_ratio or self.reference is None
+            self.reference = small
+        elif self.reference is None or self.reference.shape != small.shape:
+            active = True
+        else:
+            diff = cv2.absdiff(small, self.reference)
+            changed = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+            active = changed >= self.min_changed_ratio
+
+        if not active and self.gap + 1 >= self.max_gap:
+            active = True  # Ép detect định kỳ để làm mới kết quả
+
+        if active:
+            if self._subtractor is None:
+                self.reference = small
+            self.gap = 0
+            self.active_frames += 1
+        else:
+            self.gap += 1
+            self.gated_frames += 1
+        return active
+
+    def stats(self) -> Dict[str, float]:
+        total = self.active_frames + self.gated_frames
+        return {
+            'active_frames': self.active_frames,
+            'gated_frames': self.gated_frames,
+            'gated_ratio': (self.gated_frames / total) if total else 0.0,
+        }
@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import function.helper as helper
 import torch
 import numpy as np
@@ -6,6 +6,8 @@ from .gpu_optimizer import get_device, get_gpu_info
 
 
 class OcrEngine:
+    model_path = 'model/LP_ocr.pt'
+
     def __init__(self, conf_threshold: float = 0.60, device: Optional[str] = None, use_gpu: bool = True):
         """
         Initialize OCR Engine
@@ -27,7 +29,7 @@ class OcrEngine:
             self.model = torch.hub.load(
                 'yolov5', 
                 'custom', 
-                path='model/LP_ocr.pt', 
+                path=self.model_path, 
                 force_reload=False, 
                 source='local',
                 device=device
@@ -54,7 +56,7 @@ class OcrEngine:
                 self.model = torch.hub.load(
                     'yolov5', 
                     'custom', 
-                    path='model/LP_ocr.pt', 
+                    path=self.model_path, 
                     force_reload=False, 
                     source='local',
                     device=device
@@ -90,44 +92,71 @@ class OcrEngine:
                 return None
             raise
 
-    def read_text_batch(self, rois: List[np.ndarray]) -> List[Optional[str]]:
+    def read_text_batch(self, rois: List[np.ndarray], batch_size: int = 32) -> List[Optional[str]]:
         """
-        Read text from multiple ROIs (batch processing for GPU optimization)
-        
-        Note: This is a wrapper that processes sequentially since helper.read_plate
-        doesn't support true batch processing. For better performance, consider
-        modifying helper.read_plate to support batch processing.
+        Read text from multiple ROIs with batched character detection
         
         Args:
             rois: List of ROI images (numpy arrays)
+            batch_size: Maximum number of ROIs per forward pass
             
         Returns:
             List of detected texts (None if not detected or 'unknown')
         """
+        return [text for text, _ in self.read_text_batch_with_conf(rois, batch_size=batch_size)]
+
+    def read_text_batch_with_conf(self, rois: List[np.ndarray], batch_size: int = 32) -> List[Tuple[Optional[str], List[float]]]:
+        """
+        Read text and per-character confidences from multiple ROIs
+        
+        All ROIs in a chunk are letterboxed into one tensor and go through a single
+        forward pass of the character detector; the characters of each ROI are then
+        decoded from its own slice of the results.
+        
+        Args:
+            rois: List of ROI images (numpy arrays)
+            batch_size: Maximum number of ROIs per forward pass
+            
+        Returns:
+            List of (text, char_confidences) tuples; text is None (and confidences
+            empty) if not detected or 'unknown'
+        """
         if not rois:
             return []
         
-        texts = []
-        for roi in rois:
+        batch_size = max(1, int(batch_size))
+        reads: List[Tuple[Optional[str], List[float]]] = [(None, [])] * len(rois)
+        # Empty crops cannot be letterboxed, leave them as None
+        valid = [i for i, roi in enumerate(rois) if roi is not None and roi.size > 0]
+        for start in range(0, len(valid), batch_size):
+            positions = valid[start:start + batch_size]
+            chunk = [rois[i] for i in positions]
             try:
-                text = helper.read_plate(self.model, roi)
-                if text and text != 'unknown':
-                    texts.append(text)
-                else:
-                    texts.append(None)
+                plates = helper.read_plate_batch(self.model, chunk)
             except RuntimeError as e:
                 if 'out of memory' in str(e).lower():
                     print(f"⚠️ GPU OOM during batch OCR, clearing cache...")
                     torch.cuda.empty_cache()
-                    # Retry
-                    text = helper.read_plate(self.model, roi)
-                    if text and text != 'unknown':
-                        texts.append(text)
-                    else:
-                        texts.append(None)
-                else:
-                    texts.append(None)
+                # Fallback: process one by one, a crop that still fails reads as None
+                plates = [self._read_one(roi) for roi in chunk]
+            for i, (text, confs) in zip(positions, plates):
+                if text and text != 'unknown':
+                    reads[i] = (text, confs)
         
-        return texts
+        return reads
+
+    def _read_one(self, roi: np.ndarray) -> Tuple[Optional[str], List[float]]:
+        """OCR a single ROI; (None, []) if the forward pass fails"""
+        try:
+            return helper.read_plate_batch(self.model, [roi])[0]
+        except RuntimeError as e:
+            if 'out of memory' in str(e).lower():
+                torch.cuda.empty_cache()
+            return None, []
 
 
+def plate_score(confs: List[float]) -> Optional[float]:
+    """Aggregate per-character confidences into a single OCR score (mean)"""
+    if not confs:
+        return None
+    return float(sum(confs) / len(confs))
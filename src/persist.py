@@ -0,0 +1,71 @@
+"""
+Ghi Appearance theo lô: gom rows của một video, insert bằng Core executemany trong một transaction
+thay vì session.add + commit từng row qua ORM
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from .db import Appearance
+
+
+class AppearanceWriter:
+    def __init__(self, session, batch_size: int = 1000):
+        """
+        Args:
+            session: Session dùng chung của job
+            batch_size: Số rows mỗi câu executemany
+
+        Rows chỉ được ghi khi commit(); job gọi commit() sau mỗi video để kết quả các video
+        đã xong không phụ thuộc vào phần còn lại của job.
+        """
+        self.session = session
+        self.batch_size = max(1, int(batch_size))
+        self.rows: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = []
+        self.count = 0
+        table = Appearance.__table__
+        dialect = session.get_bind().dialect
+        # SQLAlchemy 2.0 + SQLite >= 3.35: executemany vẫn trả id theo đúng thứ tự rows
+        if getattr(dialect, 'insert_executemany_returning_sort_by_parameter_order', False):
+            self._stmt = insert(table).returning(table.c.appearance_id, sort_by_parameter_order=True)
+            self._returning = True
+        else:
+            self._stmt = insert(table)
+            self._returning = False
+
+    def add(self, row: Dict[str, Any], entry: Optional[Dict[str, Any]] = None):
+        """
+        Thêm một appearance
+
+        Args:
+            row: Giá trị các cột của Appearance
+            entry: Segment dict sẽ được điền 'appearance_id' khi row được ghi
+        """
+        self.rows.append((row, entry))
+
+    def _write(self, rows: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]):
+        if self._returning:
+            result = self.session.execute(self._stmt, [row for row, _ in rows])
+            for (_, entry), appearance_id in zip(rows, result.scalars()):
+                if entry is not None:
+                    entry['appearance_id'] = appearance_id
+        elif any(entry is not None for _, entry in rows):
+            # Không có executemany + RETURNING: insert từng row để lấy id (vẫn trong một transaction)
+            for row, entry in rows:
+                result = self.session.execute(self._stmt, row)
+                if entry is not None:
+                    entry['appearance_id'] = result.inserted_primary_key[0]
+        else:
+            self.session.execute(self._stmt, [row for row, _ in rows])
+        self.count += len(rows)
+
+    def commit(self):
+        """Ghi mọi rows đã gom (từ lần commit trước) trong một transaction"""
+        rows, self.rows = self.rows, []
+        try:
+            for i in range(0, len(rows), self.batch_size):
+                self._write(rows[i:i + self.batch_size])
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
@@ -0,0 +1,151 @@
+"""
+Pipelined frame analysis: decode -> detect -> OCR chạy trên các thread riêng,
+nối bằng queue có giới hạn (backpressure) để decode video chồng lên inference
+"""
+import queue
+import threading
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+_DONE = object()  # Sentinel báo stage phía trước đã hết dữ liệu
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put có backpressure nhưng vẫn thoát được khi pipeline bị dừng"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(batches: Iterable[Tuple[List[int], List]],
+                 detect_fn: Callable[[List], List[List]],
+                 ocr_fn: Callable[[List, List[List]], List[List]],
+                 queue_size: int = 4,
+                 detect_workers: int = 1,
+                 ocr_workers: int = 1,
+                 cancellation_flag: Optional[threading.Event] = None):
+    """
+    Run decode / detect / OCR stages concurrently
+
+    Args:
+        batches: Iterable of (frame_indices, frames); consumed by a single decoder thread
+        detect_fn: frames -> boxes per frame
+        ocr_fn: (frames, boxes per frame) -> reads per frame
+        queue_size: Max batches waiting between two stages
+        detect_workers: Number of detector threads
+        ocr_workers: Number of OCR threads
+        cancellation_flag: Stops every stage when set
+
+    Yields:
+        (frame_indices, reads per frame) in the original batch order
+    """
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    q_decoded: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    q_detected: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    q_out: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    detect_workers = max(1, int(detect_workers))
+    ocr_workers = max(1, int(ocr_workers))
+    remaining = {'detect': detect_workers, 'ocr': ocr_workers}
+    remaining_lock = threading.Lock()
+
+    def fail(e: BaseException):
+        errors.append(e)
+        stop.set()
+
+    def finish(stage: str, next_q: queue.Queue, n_next: int):
+        # Worker cuối cùng của stage báo hết dữ liệu cho stage sau
+        with remaining_lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(n_next):
+                _put(next_q, _DONE, stop)
+
+    def decoder():
+        try:
+            for seq, (indices, frames) in enumerate(batches):
+                if stop.is_set() or (cancellation_flag and cancellation_flag.is_set()):
+                    break
+                if not _put(q_decoded, (seq, indices, frames), stop):
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            # Giải phóng VideoCapture ngay trên thread decode
+            close = getattr(batches, 'close', None)
+            if close is not None:
+                close()
+            for _ in range(detect_workers):
+                _put(q_decoded, _DONE, stop)
+
+    def detector():
+        try:
+            while True:
+                item = _get(q_decoded, stop)
+                if item is _DONE:
+                    break
+                seq, indices, frames = item
+                boxes = detect_fn(frames)
+                if not _put(q_detected, (seq, indices, frames, boxes), stop):
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            finish('detect', q_detected, ocr_workers)
+
+    def reader():
+        try:
+            while True:
+                item = _get(q_detected, stop)
+                if item is _DONE:
+                    break
+                seq, indices, frames, boxes = item
+                reads = ocr_fn(frames, boxes)
+                if not _put(q_out, (seq, indices, reads), stop):
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            finish('ocr', q_out, 1)
+
+    threads = [threading.Thread(target=decoder, name='vjts-decode', daemon=True)]
+    threads += [threading.Thread(target=detector, name=f'vjts-detect-{i}', daemon=True) for i in range(detect_workers)]
+    threads += [threading.Thread(target=reader, name=f'vjts-ocr-{i}', daemon=True) for i in range(ocr_workers)]
+    for t in threads:
+        t.start()
+
+    try:
+        # Nhiều worker có thể trả batch lệch thứ tự -> sắp lại theo seq
+        pending: dict = {}
+        next_seq = 0
+        while True:
+            if cancellation_flag and cancellation_flag.is_set():
+                break
+            item = _get(q_out, stop)
+            if item is _DONE:
+                break
+            seq, indices, reads = item
+            pending[seq] = (indices, reads)
+            while next_seq in pending:
+                yield pending.pop(next_seq)
+                next_seq += 1
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
@@ -0,0 +1,159 @@
+"""
+Fuzzy plate lookup: BK-tree trên các biển số đã normalize (từ plate_reads và appearances)
+để tìm mọi biển số trong khoảng cách Levenshtein <= max_distance mà không quét toàn bảng
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, or_
+
+from .db import Appearance, PlateRead, VideoIndex, init_db
+from .matcher import levenshtein, normalize
+
+
+class BKTree:
+    """Burkhard-Keller tree theo khoảng cách Levenshtein"""
+
+    def __init__(self):
+        # node = (word, {distance: child_node})
+        self.root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, word: str) -> bool:
+        """Thêm word, trả về False nếu đã có"""
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return True
+        node = self.root
+        while True:
+            d = levenshtein(word, node[0])
+            if d == 0:
+                return False
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Trả về [(distance, word), ...] với distance <= max_distance, sắp theo distance"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_word, children = stack.pop()
+            d = levenshtein(word, node_word)
+            if d <= max_distance:
+                found.append((d, node_word))
+            # Bất đẳng thức tam giác: chỉ các nhánh có cạnh trong [d - k, d + k] mới có thể khớp
+            lo, hi = d - max_distance, d + max_distance
+            for edge, child in children.items():
+                if lo <= edge <= hi:
+                    stack.append(child)
+        found.sort()
+        return found
+
+
+class PlateSearchIndex:
+    """BK-tree + số lần xuất hiện của mỗi biển số, dựng từ DB"""
+
+    def __init__(self):
+        self.tree = BKTree()
+        self.counts: Dict[str, int] = {}
+        self.built_at = 0.0
+
+    @classmethod
+    def from_session(cls, session) -> 'PlateSearchIndex':
+        index = cls()
+        # Chỉ reads thuộc index đã hoàn chỉnh (bỏ reads của lần quét đang chạy / bị bỏ dở)
+        current = or_(PlateRead.generation == VideoIndex.generation,
+                      and_(PlateRead.generation.is_(None), VideoIndex.generation.is_(None)))
+        rows = (session.query(PlateRead.text, func.count())
+                .join(VideoIndex, VideoIndex.video_id == PlateRead.video_id)
+                .filter(PlateRead.text.isnot(None), current)
+                .group_by(PlateRead.text))
+        for text, n in rows:
+            index._add(text, n)
+        rows = session.query(Appearance.plate, func.count()).group_by(Appearance.plate)
+        for plate, n in rows:
+            index._add(plate, n)
+        index.built_at = time.time()
+        return index
+
+    def _add(self, text: str, n: int):
+        key = normalize(text)
+        if not key:
+            return
+        self.tree.add(key)
+        self.counts[key] = self.counts.get(key, 0) + int(n)
+
+    def search(self, plate: str, max_distance: int = 2, limit: int = 50) -> List[Dict]:
+        query = normalize(plate)
+        if not query:
+            return []
+        hits = self.tree.search(query, max(0, int(max_distance)))
+        return [
+            {'plate': word, 'distance': d, 'count': self.counts.get(word, 0)}
+            for d, word in hits[:limit]
+        ]
+
+
+_indexes: Dict[str, PlateSearchIndex] = {}
+_build_locks: Dict[str, threading.Lock] = {}
+_rebuilding: Set[str] = set()
+_indexes_lock = threading.Lock()
+
+
+def _build(db_path: str) -> PlateSearchIndex:
+    session = init_db(db_path)()
+    try:
+        return PlateSearchIndex.from_session(session)
+    finally:
+        session.close()
+
+
+def _rebuild(db_path: str):
+    """Dựng lại index trong thread nền rồi mới thay bản cũ (search vẫn dùng bản cũ trong lúc dựng)"""
+    try:
+        index = _build(db_path)
+    except Exception as e:
+        print(f"⚠️ Plate index rebuild failed: {e}")
+        index = None
+    with _indexes_lock:
+        if index is not None:
+            _indexes[db_path] = index
+        _rebuilding.discard(db_path)
+
+
+def get_plate_index(db_path: str, max_age: float = 60.0) -> PlateSearchIndex:
+    """
+    Lấy index của DB (cache trong process)
+
+    Chỉ lần đầu mới dựng đồng bộ; khi index cũ hơn max_age giây, bản hiện tại vẫn được trả về
+    ngay và một thread nền dựng bản mới để thay vào.
+    """
+    with _indexes_lock:
+        index = _indexes.get(db_path)
+        if index is not None:
+            if time.time() - index.built_at > max_age and db_path not in _rebuilding:
+                _rebuilding.add(db_path)
+                threading.Thread(target=_rebuild, args=(db_path,), name='plate-index-rebuild', daemon=True).start()
+            return index
+        build_lock = _build_locks.setdefault(db_path, threading.Lock())
+
+    # Lần đầu: chỉ các request cùng DB chờ nhau, không giữ lock chung
+    with build_lock:
+        with _indexes_lock:
+            index = _indexes.get(db_path)
+        if index is None:
+            index = _build(db_path)
+            with _indexes_lock:
+                _indexes[db_path] = index
+        return index
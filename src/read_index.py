@@ -0,0 +1,204 @@
+"""
+Persistent plate-read index: lưu mọi OCR read của video đã quét vào DB
+để các lần tìm kiếm sau trả lời trực tiếp từ index, không decode lại video
+"""
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, or_
+
+from .db import PlateRead, VideoIndex
+from .ocr import plate_score
+
+
+# (path, mtime, size) -> sha1, tránh hash lại file weights mỗi job
+_hash_cache: Dict[Tuple[str, float, int], str] = {}
+
+
+def file_sha1(path: str) -> str:
+    """SHA1 của nội dung file (cache theo mtime/size), '' nếu file không tồn tại"""
+    if not os.path.exists(path):
+        return ''
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime, st.st_size)
+    if key not in _hash_cache:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        _hash_cache[key] = h.hexdigest()
+    return _hash_cache[key]
+
+
+def model_fingerprint(paths: Iterable[str]) -> str:
+    """Hash chung của các file weights (detector + OCR)"""
+    h = hashlib.sha1()
+    for p in paths:
+        h.update(p.encode('utf-8'))
+        h.update(file_sha1(p).encode('ascii'))
+    return h.hexdigest()[:16]
+
+
+def make_index_key(model_hash: str, conf: float, frame_step: int, variant: str = '') -> str:
+    """Mọi tham số làm thay đổi tập reads đều phải nằm trong key"""
+    key = f'{model_hash}|conf={conf:.3f}|step={int(frame_step)}'
+    return f'{key}|{variant}' if variant else key
+
+
+def video_signature(path: str) -> Tuple[float, int]:
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+# (path, mtime, size, blocks, block_size) -> fingerprint
+_fingerprint_cache: Dict[Tuple, str] = {}
+
+
+def content_fingerprint(path: str, blocks: int = 16, block_size: int = 64 * 1024) -> str:
+    """
+    Fingerprint nhanh của nội dung video: size + SHA1 của vài block rải đều trong file
+
+    Cùng một file export copy / upload lại sang path khác cho cùng fingerprint mà không phải
+    đọc hết file (chỉ đọc tối đa blocks * block_size byte).
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime, st.st_size, blocks, block_size)
+    if key not in _fingerprint_cache:
+        size = st.st_size
+        h = hashlib.sha1(str(size).encode('ascii'))
+        with open(path, 'rb') as f:
+            if size <= blocks * block_size:
+                h.update(f.read())
+            else:
+                # Block đầu, block cuối và các block cách đều ở giữa
+                step = (size - block_size) / (blocks - 1) if blocks > 1 else 0
+                for i in range(max(1, blocks)):
+                    f.seek(int(i * step))
+                    h.update(f.read(block_size))
+        _fingerprint_cache[key] = f'{size}:{h.hexdigest()}'
+    return _fingerprint_cache[key]
+
+
+def get_fresh_index(session, video_id: int, video_path: str, index_key: str,
+                    fingerprint: Optional[str] = None) -> Optional[VideoIndex]:
+    """
+    Trả về VideoIndex nếu index của video còn dùng được, ngược lại None
+
+    fingerprint: content_fingerprint của video_path; khi có, index của một bản copy khác
+    (mtime khác) nhưng cùng nội dung vẫn được coi là còn mới.
+    """
+    entry = session.get(VideoIndex, video_id)
+    if entry is None or entry.index_key != index_key:
+        return None
+    if fingerprint and entry.content_hash == fingerprint:
+        return entry
+    mtime, size = video_signature(video_path)
+    if entry.size != size or abs(entry.mtime - mtime) > 1e-6:
+        return None
+    return entry
+
+
+def replay_reads(session, entry: VideoIndex):
+    """
+    Phát lại reads đã index theo đúng thứ tự frame như khi quét video
+
+    Yields:
+        (frame_idx, reads) cho mọi frame đã phân tích (kể cả frame không có read,
+        để SegmentAccumulator tính lost_tolerance như lúc quét thật); roi là None
+    """
+    if entry.generation is None:
+        generation = PlateRead.generation.is_(None)  # Index ghi trước khi có generation
+    else:
+        generation = PlateRead.generation == entry.generation
+    rows = (session.query(PlateRead)
+            .filter(PlateRead.video_id == entry.video_id, generation)
+            .order_by(PlateRead.frame_idx, PlateRead.read_id)
+            .all())
+    by_frame: Dict[int, List] = {}
+    for r in rows:
+        confs = json.loads(r.char_confs) if r.char_confs else []
+        box = (r.x1, r.y1, r.x2, r.y2, r.score_lp)
+        by_frame.setdefault(r.frame_idx, []).append((box, None, r.text, confs))
+    for frame_idx in range(0, entry.last_frame_idx + 1, max(1, entry.frame_step)):
+        yield frame_idx, by_frame.get(frame_idx, [])
+
+
+class ReadRecorder:
+    """
+    Ghi reads của một lần quét video vào DB, flush theo lô để không giữ hết trong RAM
+
+    Mỗi lô được commit trong một transaction ngắn với generation riêng của lần quét
+    (không giữ write lock của SQLite suốt lúc decode). Reads chỉ có hiệu lực khi commit()
+    trỏ video_index sang generation này; index cũ vẫn dùng được cho tới lúc đó.
+    """
+
+    def __init__(self, session, video_id: int, flush_size: int = 5000):
+        self.session = session
+        self.video_id = video_id
+        self.flush_size = max(1, int(flush_size))
+        self.rows: List[Dict] = []
+        self.count = 0
+        self.last_frame_idx = -1
+        self.generation = uuid.uuid4().hex
+
+    def record(self, frame_idx: int, reads: List):
+        self.last_frame_idx = max(self.last_frame_idx, frame_idx)
+        for (x1, y1, x2, y2, score), _, text, confs in reads:
+            self.rows.append({
+                'video_id': self.video_id,
+                'frame_idx': int(frame_idx),
+                'x1': float(x1), 'y1': float(y1), 'x2': float(x2), 'y2': float(y2),
+                'text': text,
+                'score_lp': float(score) if score is not None else None,
+                'score_ocr': plate_score(confs),
+                'char_confs': json.dumps([round(float(c), 4) for c in confs]) if confs else None,
+                'generation': self.generation,
+            })
+        if len(self.rows) >= self.flush_size:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.session.execute(insert(PlateRead.__table__), self.rows)
+            self.session.commit()
+            self.count += len(self.rows)
+            self.rows = []
+
+    def commit(self, video_path: str, index_key: str, frame_step: int, fingerprint: Optional[str] = None):
+        """Đánh dấu index của video là hoàn chỉnh (đổi sang generation mới + xóa reads cũ trong một transaction)"""
+        self._flush()
+        mtime, size = video_signature(video_path)
+        # Chỉ xóa reads của index đã commit trước đó (và reads chưa có generation của DB cũ);
+        # reads của một lần quét khác đang chạy song song trên cùng video phải được giữ nguyên
+        old = self.session.get(VideoIndex, self.video_id)
+        stale = [PlateRead.generation.is_(None)]
+        if old is not None and old.generation and old.generation != self.generation:
+            stale.append(PlateRead.generation == old.generation)
+        (self.session.query(PlateRead)
+         .filter(PlateRead.video_id == self.video_id, or_(*stale))
+         .delete(synchronize_session=False))
+        self.session.merge(VideoIndex(
+            video_id=self.video_id,
+            mtime=mtime,
+            size=size,
+            content_hash=fingerprint,
+            index_key=index_key,
+            frame_step=int(frame_step),
+            last_frame_idx=self.last_frame_idx,
+            reads_count=self.count,
+            indexed_at=datetime.now(),
+            generation=self.generation,
+        ))
+        self.session.commit()
+
+    def discard(self):
+        """Quét bị dừng giữa chừng: xóa các reads của lần quét này đã được commit"""
+        self.rows = []
+        (self.session.query(PlateRead)
+         .filter(PlateRead.video_id == self.video_id, PlateRead.generation == self.generation)
+         .delete(synchronize_session=False))
+        self.session.commit()
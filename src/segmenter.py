@@ -1,4 +1,4 @@
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
 
 
 class SegmentAccumulator:
@@ -14,8 +14,12 @@ class SegmentAccumulator:
         
         # Trajectory tracking: lưu tọa độ center của biển số qua các frame
         self.current_trajectory = []  # [(frame_idx, center_x, center_y), ...]
+        # Điểm tin cậy cao nhất (detector / OCR) trong segment hiện tại
+        self.best_score_lp = None
+        self.best_score_ocr = None
 
-    def update(self, frame_idx: int, matched: bool, bbox: Optional[Tuple[float, float, float, float]] = None):
+    def update(self, frame_idx: int, matched: bool, bbox: Optional[Tuple[float, float, float, float]] = None,
+               score_lp: Optional[float] = None, score_ocr: Optional[float] = None):
         """
         Update segment accumulator
         
@@ -23,8 +27,14 @@ class SegmentAccumulator:
             frame_idx: Frame index
             matched: Whether plate matched
             bbox: Optional bounding box (x1, y1, x2, y2) để tính trajectory
+            score_lp: Optional detector confidence of the matched box
+            score_ocr: Optional OCR confidence of the matched read
         """
         if matched:
+            if score_lp is not None:
+                self.best_score_lp = max(score_lp, self.best_score_lp or 0.0)
+            if score_ocr is not None:
+                self.best_score_ocr = max(score_ocr, self.best_score_ocr or 0.0)
             # Tính center point nếu có bbox
             if bbox:
                 x1, y1, x2, y2 = bbox
@@ -57,6 +67,8 @@ class SegmentAccumulator:
                     self.start_frame = -1
                     self.last_seen_frame = -1
                     self.current_trajectory = []
+                    self.best_score_lp = None
+                    self.best_score_ocr = None
 
     def _analyze_trajectory(self, pixel_to_meter: Optional[float] = None) -> Dict:
         """Phân tích trajectory của segment hiện tại"""
@@ -79,6 +91,8 @@ class SegmentAccumulator:
         segment = {
             'start_time': start_time,
             'end_time': end_time,
+            'score_lp': self.best_score_lp,
+            'score_ocr': self.best_score_ocr,
         }
         if trajectory_data:
             segment['trajectory'] = trajectory_data
@@ -89,3 +103,96 @@ class SegmentAccumulator:
         self.segments.append(segment)
 
 
+
+
+class PlateConsensus:
+    def __init__(self, iou_threshold: float = 0.3, max_gap: int = 10, min_reads: int = 1):
+        """
+        Gom các read của cùng một biển số vật lý (box liên tục qua các frame) và
+        vote từng ký tự theo char confidence của OCR
+        
+        Args:
+            iou_threshold: IoU tối thiểu với box lần trước của nhóm để coi là cùng biển số
+            max_gap: Số frame thực tế tối đa giữa hai lần thấy của một nhóm
+            min_reads: Chỉ thay text bằng consensus khi nhóm có ít nhất bấy nhiêu read
+        """
+        self.iou_threshold = float(iou_threshold)
+        self.max_gap = max(1, int(max_gap))
+        self.min_reads = max(1, int(min_reads))
+        # group = {'box', 'last_frame', 'n', 'by_len': {length: {'weight', 'chars': [{c: [sum_conf, count]}], 'dash': {pos: weight}}}}
+        self.groups = []
+
+    def update(self, frame_idx: int, reads: List) -> List:
+        """
+        Thêm reads của một frame và trả về reads với text/char confs là consensus của nhóm
+        
+        Args:
+            frame_idx: Frame index
+            reads: [(box, roi, text, char_confs), ...], box = (x1, y1, x2, y2, score)
+        """
+        from .tracker import iou
+
+        self.groups = [g for g in self.groups if frame_idx - g['last_frame'] <= self.max_gap]
+        out = []
+        used = set()
+        for read in reads:
+            box, roi, text, confs = read
+            best, best_iou = None, self.iou_threshold
+            for gi, g in enumerate(self.groups):
+                if gi in used:
+                    continue
+                score = iou(g['box'], box)
+                if score >= best_iou:
+                    best, best_iou = gi, score
+            if best is None:
+                self.groups.append({'box': box, 'last_frame': frame_idx, 'n': 0, 'by_len': {}})
+                best = len(self.groups) - 1
+            used.add(best)
+            group = self.groups[best]
+            group['box'] = box
+            group['last_frame'] = frame_idx
+            self._add(group, text, confs)
+            if group['n'] >= self.min_reads:
+                fused = self._consensus(group)
+                if fused is not None:
+                    text, confs = fused
+            out.append((box, roi, text, confs))
+        return out
+
+    @staticmethod
+    def _add(group: Dict, text: Optional[str], confs: List[float]):
+        if not text:
+            return
+        chars = text.replace('-', '')
+        if not chars:
+            return
+        if len(confs) != len(chars):
+            # Không có conf từng ký tự: dùng conf trung bình cho mọi vị trí
+            mean = sum(confs) / len(confs) if confs else 1.0
+            confs = [mean] * len(chars)
+        entry = group['by_len'].setdefault(len(chars), {'weight': 0.0, 'chars': [{} for _ in chars], 'dash': {}})
+        entry['weight'] += sum(confs) / len(confs)
+        for pos, (c, conf) in enumerate(zip(chars, confs)):
+            acc = entry['chars'][pos].setdefault(c, [0.0, 0])
+            acc[0] += conf
+            acc[1] += 1
+        dash = text.find('-')
+        entry['dash'][dash] = entry['dash'].get(dash, 0.0) + 1.0
+        group['n'] += 1
+
+    @staticmethod
+    def _consensus(group: Dict) -> Optional[Tuple[str, List[float]]]:
+        """Chuỗi vote theo vị trí (trên độ dài có tổng trọng số lớn nhất) và conf trung bình từng ký tự"""
+        if not group['by_len']:
+            return None
+        entry = max(group['by_len'].values(), key=lambda e: e['weight'])
+        chars, confs = [], []
+        for votes in entry['chars']:
+            c, (total, count) = max(votes.items(), key=lambda kv: kv[1][0])
+            chars.append(c)
+            confs.append(total / count)
+        text = ''.join(chars)
+        dash = max(entry['dash'].items(), key=lambda kv: kv[1])[0]
+        if 0 < dash < len(text):
+            text = text[:dash] + '-' + text[dash:]
+        return text, confs
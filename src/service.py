@@ -1,20 +1,35 @@
+import filecmp
 import os
+import re
 import json
 from datetime import datetime
 from typing import Dict, Any, List, Callable, Optional
 import threading
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import torch
 import yaml
+from sqlalchemy.exc import IntegrityError
 
 from .detector import LicensePlateDetector
-from .ocr import OcrEngine
-from .matcher import is_match, normalize
-from .videoio import iterate_frames, iterate_frames_batch, get_video_info
-from .segmenter import SegmentAccumulator
-from .concat import concat_segments
-from .db import init_db, Video as DbVideo, Appearance as DbAppearance, Job as DbJob
+from .ocr import OcrEngine, plate_score
+from .matcher import PlateMatcher, match_many, normalize
+from .videoio import iterate_frames, iterate_frames_batch, iterate_frame_ranges, get_video_info
+from .segmenter import SegmentAccumulator, PlateConsensus
+from .concat import concat_segments, merge_segments
+from .db import init_db, Video as DbVideo, Job as DbJob
 from .gpu_optimizer import get_optimal_batch_size, clear_gpu_cache, log_gpu_info, get_gpu_info
-from .annotate import annotate_video_with_detections
+from .annotate import annotate_video_with_detections, annotate_segment
+from .model_pool import ModelLease, get_model_pool
+from .motion import MotionGate
+from .persist import AppearanceWriter
+from .pipeline import run_pipeline
+from .tracker import PlateTracker
+from .read_index import (
+    ReadRecorder, content_fingerprint, get_fresh_index, make_index_key, model_fingerprint, replay_reads
+)
 
 
 def load_config(config_path: str | None) -> Dict[str, Any]:
@@ -52,18 +67,18 @@ def clear_cancellation_flag(job_id: str):
         _cancellation_flags.pop(job_id, None)
 
 
-def run_job(plate: str,
-            video_dir: str,
-            output_dir: str,
-            config_path: str | None = None,
-            annotate: bool = False,
-            ffmpeg_path: str | None = None,
-            db_path: str = 'db/vjts.sqlite',
-            on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
-            on_crop: Optional[Callable[[bytes], None]] = None,
-            cancellation_flag: Optional[threading.Event] = None) -> Dict[str, Any]:
-    cfg = load_config(config_path)
+def _dedup_settings(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Dedup theo nội dung: cùng một file copy / upload lại dùng chung Video row + index"""
+    dedup_cfg = cfg.get('dedup', {}) or {}
+    return {
+        'enabled': bool(dedup_cfg.get('enabled', True)),
+        'blocks': max(1, int(dedup_cfg.get('sample_blocks', 16))),
+        'block_size': max(4, int(dedup_cfg.get('block_kb', 64))) * 1024,
+    }
 
+
+def _resolve_settings(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Đọc tham số job từ config (kèm default) và tự chọn batch size theo GPU"""
     def param(name: str, default):
         # nested lookup helper
         nested = {
@@ -100,6 +115,9 @@ def run_job(plate: str,
     auto_batch_size = cfg.get('gpu', {}).get('auto_batch_size', True)
     frame_skip = cfg.get('gpu', {}).get('frame_skip', 2)
     clear_cache_interval = cfg.get('gpu', {}).get('clear_cache_interval', 100)
+    ocr_batch_size = cfg.get('gpu', {}).get('ocr_batch_size', 32)
+    decode_mode = cfg.get('gpu', {}).get('decode_mode', 'grab')
+    seek_min_skip = int(cfg.get('gpu', {}).get('seek_min_skip', 60))
     
     # Trajectory calibration (để tính tốc độ thực)
     pixel_to_meter = cfg.get('calibration', {}).get('pixel_to_meter', None)
@@ -128,275 +146,1096 @@ def run_job(plate: str,
     if gpu_enabled:
         log_gpu_info()
 
+    # Persistent read index
+    index_cfg = cfg.get('index', {}) or {}
+    index_enabled = bool(index_cfg.get('enabled', False))
+    use_index = bool(index_cfg.get('use_cache', index_enabled))
+    use_batch = gpu_enabled and gpu_batch_size > 1
+
+    # Pipeline decode -> detect -> OCR trên các thread riêng
+    pipeline_cfg = cfg.get('pipeline', {}) or {}
+    pipeline = {
+        'enabled': bool(pipeline_cfg.get('enabled', False)),
+        'queue_size': int(pipeline_cfg.get('queue_size', 4)),
+        'detect_workers': int(pipeline_cfg.get('detect_workers', 1)),
+        'ocr_workers': int(pipeline_cfg.get('ocr_workers', 1)),
+    }
+
+    # Track-then-read: OCR mỗi track vài lần thay vì mọi box ở mọi frame
+    tracker = (cfg.get('tracking', {}) or {}).get('tracker') or {}
+
+    # Consensus và tracker cùng ghép box qua các frame rồi vote text: tracker bật thì bỏ consensus
+    consensus = (cfg.get('matching', {}) or {}).get('consensus') or {}
+    if consensus.get('enabled') and tracker.get('enabled'):
+        print("⚠️ matching.consensus is ignored while tracking.tracker is enabled (tracker already votes per track)")
+        consensus = {**consensus, 'enabled': False}
+
+    # Early exit: N lần xuất hiện đầu tiên / lần đầu thấy ở mỗi camera
+    search_cfg = cfg.get('search', {}) or {}
+    coarse_cfg = search_cfg.get('coarse_to_fine') or {}
+
+    # Cắt + ghép video kết quả
+    concat_cfg = cfg.get('concat', {}) or {}
+
+    # Nhiều video chạy song song trên process pool
+    parallel_cfg = cfg.get('parallel', {}) or {}
+
+    # Annotate: segments (mặc định) chỉ decode các cửa sổ đã match; inline cũ decode + encode lại
+    # cả video song song với lượt quét nên được thay bằng segments
+    annotate_mode = (cfg.get('annotate', {}) or {}).get('mode', 'segments')
+    if annotate_mode == 'inline':
+        print("⚠️ annotate.mode 'inline' is no longer supported, using 'segments'")
+        annotate_mode = 'segments'
+
+    # Model pool dùng chung giữa các job (mặc định mỗi job chạy đồng thời một cặp model)
+    models_cfg = cfg.get('models', {}) or {}
+    pool_size = models_cfg.get('pool_size') or (cfg.get('jobs', {}) or {}).get('max_concurrent', 1)
+
+    return {
+        'conf': conf,
+        'match_mode': match_mode,
+        'max_dist': max_dist,
+        'lost': lost,
+        'pre_pad': pre_pad,
+        'post_pad': post_pad,
+        'merge_gap': float((cfg.get('trim', {}) or {}).get('merge_gap', 0.0) or 0.0),
+        'gpu_enabled': gpu_enabled,
+        'use_batch': use_batch,
+        'batch_size': gpu_batch_size if use_batch else 1,
+        'frame_skip': frame_skip,
+        # Khoảng cách thực giữa các frame được phân tích (chế độ từng frame không skip)
+        'frame_step': max(1, int(frame_skip)) if use_batch else 1,
+        'clear_cache_interval': clear_cache_interval,
+        'ocr_batch_size': ocr_batch_size,
+        'pixel_to_meter': pixel_to_meter,
+        'index_enabled': index_enabled,
+        'use_index': use_index,
+        'index_flush_size': int(index_cfg.get('flush_size', 5000)),
+        'db_batch_size': int((cfg.get('db', {}) or {}).get('batch_size', 1000)),
+        'pipeline': pipeline,
+        'decode_mode': decode_mode,
+        'motion_gate': cfg.get('motion_gate') or {},
+        'tracker': tracker,
+        'max_appearances': int(search_cfg.get('max_appearances') or 0),
+        'coarse': {
+            'enabled': bool(coarse_cfg.get('enabled', False)),
+            'interval_sec': float(coarse_cfg.get('interval_sec', 1.0)),
+            'extra_distance': int(coarse_cfg.get('extra_distance', 1)),
+        },
+        'annotate_mode': annotate_mode,
+        'concat': {
+            'mode': concat_cfg.get('mode', 'accurate'),
+            'max_workers': concat_cfg.get('max_workers'),
+            'threads_per_ffmpeg': concat_cfg.get('threads_per_ffmpeg'),
+        },
+        'first_per_camera': bool(search_cfg.get('first_per_camera', False)),
+        'consensus': consensus,
+        'seek_min_skip': seek_min_skip,
+        'workers': max(1, int(parallel_cfg.get('workers', 1) or 1)),
+        'threads_per_worker': parallel_cfg.get('threads_per_worker'),
+        'dedup': _dedup_settings(cfg),
+        'model_pool': {
+            'size': max(1, int(pool_size or 1)),
+            'warmup': bool(models_cfg.get('warmup', True)),
+        },
+    }
+
+
+
+def _index_variant(st: Dict[str, Any]) -> str:
+    """Tùy chọn làm thay đổi reads lưu trong index (phải nằm trong index key)"""
+    parts = []
+    if st['tracker'].get('enabled'):
+        parts.append('track')
+    # Motion gate quyết định frame nào được detect/OCR (frame bị gate giữ reads của frame trước)
+    gate = MotionGate.from_config(st['motion_gate'])
+    if gate is not None:
+        parts.append(gate.signature())
+    return '|'.join(parts)
+
+
+def parse_plate_list(text: str) -> List[str]:
+    """Split a watchlist given as text (comma, semicolon or newline separated) into plates"""
+    return [p.strip() for p in re.split(r'[,;\n]+', text or '') if p.strip()]
+
+
+def _detect_batch(detector: LicensePlateDetector, frames: List) -> List[List]:
+    """Batch detect với fallback từng frame khi GPU OOM"""
+    try:
+        return detector.detect_batch(frames)
+    except RuntimeError as e:
+        if 'out of memory' in str(e).lower():
+            print(f"⚠️ GPU OOM, reducing batch size and retrying...")
+            clear_gpu_cache()
+            return [detector.detect(frame) for frame in frames]
+        raise
+
+
+def _read_frames(ocr_engine: OcrEngine, frames: List, frame_boxes: List[List], ocr_batch_size: int,
+                 tracker: Optional[PlateTracker] = None) -> List[List]:
+    """
+    OCR every detected box of several frames with one batched call
+    
+    Args:
+        tracker: Optional PlateTracker; boxes are associated to tracks frame by frame, only
+            boxes the tracker asks for are OCR'd and every box gets its track's voted text
+    
+    Returns:
+        Per frame list of reads (box, roi, text, char_confs), box = (x1, y1, x2, y2, score);
+        None for frames skipped by the motion gate (frame is None)
+    """
+    # Batch OCR: gom toàn bộ ROI của cả batch frame vào một lần forward
+    rois = []
+    owners = []  # [(kept_pos, track), ...] cho các box cần OCR
+    kept = []  # [(frame_pos, box, roi, track), ...]
+    for i, (frame, boxes) in enumerate(zip(frames, frame_boxes)):
+        if frame is None:
+            continue
+        rois_i = [(box, frame[int(box[1]):int(box[3]), int(box[0]):int(box[2])]) for box in boxes]
+        rois_i = [(box, roi) for box, roi in rois_i if roi.size > 0]  # Skip empty ROI
+        assigned = tracker.update([box for box, _ in rois_i]) if tracker is not None else [(None, True)] * len(rois_i)
+        for (box, roi), (track, need_ocr) in zip(rois_i, assigned):
+            if need_ocr:
+                rois.append(roi)
+                owners.append((len(kept), track))
+            kept.append((i, box, roi, track))
+    texts = ocr_engine.read_text_batch_with_conf(rois, batch_size=ocr_batch_size)
+
+    frame_reads = [None if frame is None else [] for frame in frames]
+    if tracker is None:
+        for (k, _), (text, confs) in zip(owners, texts):
+            i, box, roi, _ = kept[k]
+            frame_reads[i].append((box, roi, text, confs))
+        return frame_reads
+
+    # Vote trước, sau đó mọi box của track (kể cả box không OCR) nhận chuỗi thắng phiếu
+    for (_, track), (text, confs) in zip(owners, texts):
+        track.add_read(text, confs)
+    for i, box, roi, track in kept:
+        text, confs = track.voted()
+        frame_reads[i].append((box, roi, text, confs))
+    return frame_reads
+
+
+def _detect_active(detect_fn: Callable[[List], List[List]], frames: List) -> List:
+    """Chỉ detect các frame không bị motion gate loại (frame None -> boxes None)"""
+    active = [f for f in frames if f is not None]
+    boxes = iter(detect_fn(active) if active else [])
+    return [next(boxes) if f is not None else None for f in frames]
+
+
+def _gate_batches(batches, gate: MotionGate):
+    """Thay frame không có chuyển động bằng None để bỏ qua detect/OCR"""
+    try:
+        for indices, frames in batches:
+            yield indices, [f if gate.is_active(f) else None for f in frames]
+    finally:
+        batches.close()
+
+
+def _iter_frame_reads(video_path: str,
+                      detector: LicensePlateDetector,
+                      ocr_engine: OcrEngine,
+                      batch_size: int,
+                      frame_skip: int,
+                      ocr_batch_size: int,
+                      clear_cache_interval: int,
+                      pipeline: Optional[Dict[str, Any]] = None,
+                      decode_mode: str = 'grab',
+                      seek_min_skip: int = 60,
+                      motion_gate: Optional[Dict[str, Any]] = None,
+                      tracker: Optional[Dict[str, Any]] = None,
+                      ranges: Optional[List[tuple]] = None,
+                      on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      cancellation_flag: Optional[threading.Event] = None):
+    """
+    Run detection + OCR over a video
+    
+    Args:
+        pipeline: Pipeline settings ('enabled', 'queue_size', 'detect_workers', 'ocr_workers');
+            when enabled decode, detection and OCR run on separate threads
+        decode_mode, seek_min_skip: How skipped frames are decoded, see iterate_frames_batch
+        motion_gate: motion_gate config section; frames without motion skip detection and
+            reuse the reads of the last detected frame (nothing moved, same plates)
+        tracker: tracking.tracker config section; plates are tracked across frames and
+            each track is OCR'd only a few times, see PlateTracker
+        ranges: Only analyse these (start_frame, end_frame) ranges, see iterate_frame_ranges
+    
+    Yields:
+        (frame_idx, reads) for every analysed frame, reads as returned by _read_frames
+    """
+    if ranges is not None:
+        # Chỉ decode các khoảng frame cho trước (coarse-to-fine search)
+        batches = iterate_frame_ranges(video_path, ranges, batch_size=max(1, batch_size), frame_skip=frame_skip,
+                                       decode_mode=decode_mode, seek_min_skip=seek_min_skip)
+    elif batch_size > 1:
+        # Batch processing mode
+        batches = iterate_frames_batch(video_path, batch_size=batch_size, frame_skip=frame_skip,
+                                       decode_mode=decode_mode, seek_min_skip=seek_min_skip)
+    else:
+        # Single frame processing (CPU mode or batch_size=1)
+        batches = (([frame_idx], [frame]) for frame_idx, frame in iterate_frames(video_path))
+    if batch_size > 1:
+        detect_fn = lambda frames: _detect_batch(detector, frames)
+    else:
+        detect_fn = lambda frames: [detector.detect(frames[0])]
+    plate_tracker = PlateTracker.from_config(tracker)
+    ocr_fn = lambda frames, boxes: _read_frames(ocr_engine, frames, boxes, ocr_batch_size, plate_tracker)
+
+    gate = MotionGate.from_config(motion_gate)
+    if gate is not None:
+        batches = _gate_batches(batches, gate)
+        raw_detect_fn = detect_fn
+        detect_fn = lambda frames: _detect_active(raw_detect_fn, frames)
+
+    pipelined = bool(pipeline and pipeline.get('enabled'))
+    if pipelined and plate_tracker is not None and (pipeline.get('detect_workers', 1) > 1 or pipeline.get('ocr_workers', 1) > 1):
+        # Tracker cần nhận các frame đúng thứ tự -> chỉ một worker mỗi stage
+        print("⚠️ Tracker enabled, using 1 detect worker and 1 OCR worker")
+        pipeline = dict(pipeline, detect_workers=1, ocr_workers=1)
+    if pipelined:
+        # Thread decode sở hữu `batches` và tự đóng nó khi pipeline dừng
+        results = run_pipeline(
+            batches, detect_fn, ocr_fn,
+            queue_size=pipeline.get('queue_size', 4),
+            detect_workers=pipeline.get('detect_workers', 1),
+            ocr_workers=pipeline.get('ocr_workers', 1),
+            cancellation_flag=cancellation_flag,
+        )
+    else:
+        results = ((indices, ocr_fn(frames, detect_fn(frames))) for indices, frames in batches)
+
+    batch_num = 0
+    frames_processed = 0
+    last_reads: List = []
+    try:
+        for batch_indices, frame_reads in results:
+            # Check cancellation before each batch
+            if cancellation_flag and cancellation_flag.is_set():
+                break
+
+            batch_num += 1
+            if batch_size > 1 and on_event:
+                start_idx = batch_indices[0] if batch_indices else 0
+                end_idx = batch_indices[-1] if batch_indices else 0
+                on_event({'type': 'progress', 'message': f'🚀 Processing batch {batch_num}, frames {start_idx}-{end_idx}'})
+
+            for frame_idx, reads in zip(batch_indices, frame_reads):
+                if reads is None:
+                    reads = last_reads  # Frame bị gate: giữ nguyên kết quả frame trước
+                else:
+                    last_reads = reads
+                yield frame_idx, reads
+            frames_processed += len(batch_indices)
+
+            # Clear GPU cache periodically (less frequent to keep GPU busy)
+            if batch_size > 1 and frames_processed % clear_cache_interval == 0:
+                clear_gpu_cache()
+                if on_event:
+                    on_event({'type': 'progress', 'message': f'🧹 Cleared GPU cache at frame {frames_processed}'})
+    finally:
+        results.close()
+        if not pipelined:
+            batches.close()
+
+    if gate is not None:
+        gate_stats = gate.stats()
+        print(f"🎯 Motion gate: {gate_stats['gated_frames']}/{gate_stats['gated_frames'] + gate_stats['active_frames']} frames skipped detection")
+        if on_event:
+            on_event({'type': 'motion_gate', 'path': video_path, **gate_stats})
+
+    if plate_tracker is not None:
+        track_stats = plate_tracker.stats()
+        print(f"🚗 Tracker: {track_stats['tracks']} tracks, OCR {track_stats['ocr_calls']}/{track_stats['boxes']} boxes")
+        if on_event:
+            on_event({'type': 'tracker', 'path': video_path, **track_stats})
+
+    if cancellation_flag and cancellation_flag.is_set():
+        if on_event:
+            on_event({'type': 'cancelled', 'message': 'Job đã bị hủy'})
+
+
+def _scan_kwargs(st: Dict[str, Any],
+                 on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 cancellation_flag: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """Tham số chung của _iter_frame_reads lấy từ settings (trừ frame_skip)"""
+    return {
+        'batch_size': st['batch_size'],
+        'ocr_batch_size': st['ocr_batch_size'],
+        'clear_cache_interval': st['clear_cache_interval'],
+        'pipeline': st['pipeline'],
+        'decode_mode': st['decode_mode'],
+        'seek_min_skip': st['seek_min_skip'],
+        'motion_gate': st['motion_gate'],
+        'tracker': st['tracker'],
+        'on_event': on_event,
+        'cancellation_flag': cancellation_flag,
+    }
+
+
+def _coarse_ranges(video_path: str,
+                   targets: List[str],
+                   st: Dict[str, Any],
+                   fps: float,
+                   detector: LicensePlateDetector,
+                   ocr_engine: OcrEngine,
+                   on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   cancellation_flag: Optional[threading.Event] = None) -> List[tuple]:
+    """
+    Pass thưa của coarse-to-fine search: phân tích khoảng một frame mỗi interval_sec giây
+    và trả về các khoảng frame có read gần giống (khoảng cách nới rộng) một biển số đích
+    
+    Returns:
+        Sorted, merged [(start_frame, end_frame), ...] for the dense pass
+    """
+    coarse = st['coarse']
+    step = max(st['frame_step'], int(round((fps or 25.0) * coarse['interval_sec'])))
+    loose = [PlateMatcher(p, 'relaxed', st['max_dist'] + coarse['extra_distance']) for p in targets]
+    # Mỗi ứng viên mở rộng ra hai mẫu thưa kề bên + lost_tolerance để segment đóng đúng
+    pad = step + st['lost'] * st['frame_step']
+
+    # Pass thưa cách nhau ~1 giây: luôn seek tới frame mẫu kế tiếp (grab vẫn decode mọi frame,
+    # và step thường nhỏ hơn seek_min_skip nên decode_mode mặc định không bao giờ seek)
+    kwargs = dict(_scan_kwargs(st, on_event, cancellation_flag), motion_gate=None, tracker=None,
+                  decode_mode='seek', seek_min_skip=0)
+    ranges: List[list] = []
+    sampled = 0
+    for frame_idx, reads in _iter_frame_reads(video_path, detector, ocr_engine, **kwargs,
+                                              frame_skip=step, ranges=[(0, None)]):
+        sampled += 1
+        if not any(any(row) for row in match_many(loose, [read[2] for read in reads])):
+            continue
+        start, end = max(0, frame_idx - pad), frame_idx + pad
+        if ranges and start <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+
+    dense = sum((e - s) // st['frame_step'] + 1 for s, e in ranges)
+    print(f"🔎 Coarse pass: {sampled} frames sampled (1/{step}), {len(ranges)} candidate ranges, ~{dense} frames for dense pass")
+    if on_event:
+        on_event({'type': 'coarse_pass', 'path': video_path, 'sampled': sampled,
+                  'ranges': [(s / (fps or 25.0), e / (fps or 25.0)) for s, e in ranges]})
+    return [tuple(r) for r in ranges]
+
+
+def _match_reads(matchers: List[PlateMatcher], reads: List) -> Dict[str, Any]:
+    """Map each target plate to the first read of the frame that matches it"""
+    matches = {}
+    if not reads:
+        return matches
+    rows = match_many(matchers, [read[2] for read in reads])
+    for read, row in zip(reads, rows):
+        for matcher, ok in zip(matchers, row):
+            if ok and matcher.plate not in matches:
+                matches[matcher.plate] = read
+    return matches
+
+
+def _model_loader(st: Dict[str, Any]) -> ModelLease:
+    """
+    Trả về lease (lazy) trên model pool dùng chung của process
+
+    Gọi lease() -> (detector, ocr_engine); model chỉ được lấy từ pool ở lần gọi đầu
+    và phải trả lại bằng lease.release() khi job xong.
+    """
+    pool = get_model_pool(st['model_pool']['size'], st['model_pool']['warmup'])
+    return pool.lease(st['gpu_enabled'], st['conf'])
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+
+def _list_videos(video_dir: str) -> List[str]:
+    """Mọi file video trong video_dir (đệ quy), sắp theo tên trong từng thư mục"""
+    paths = []
+    for root, dirs, files in os.walk(video_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(VIDEO_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return paths
+
+
+def _fingerprint(st: Dict[str, Any], video_path: str) -> Optional[str]:
+    """content_fingerprint của video theo settings dedup, None nếu tắt / không đọc được file"""
+    if not st['dedup']['enabled']:
+        return None
+    try:
+        return content_fingerprint(video_path, st['dedup']['blocks'], st['dedup']['block_size'])
+    except OSError:
+        return None
+
+
+def _dedupe_videos(video_paths: List[str], st: Dict[str, Any],
+                   on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[str]:
+    """Bỏ các file trùng nội dung với một file đứng trước trong danh sách (giữ file đầu tiên)"""
+    seen: Dict[str, str] = {}
+    kept = []
+    for path in video_paths:
+        fp = _fingerprint(st, path)
+        if fp and fp in seen:
+            if on_event:
+                on_event({'type': 'progress', 'message': f'♻️ Bỏ qua {path}: trùng nội dung với {seen[fp]}'})
+            continue
+        if fp:
+            seen[fp] = path
+        kept.append(path)
+    return kept
+
+
+def _camera_of(video_dir: str, video_path: str) -> str:
+    """Camera của video = thư mục con chứa nó trong video_dir (video nằm ngay video_dir: mỗi file là một camera)"""
+    rel = os.path.relpath(os.path.dirname(video_path), video_dir)
+    return video_path if rel == os.curdir else rel
+
+
+def _get_or_create_video(session, video_path: str, fps: float, fingerprint: Optional[str] = None) -> DbVideo:
+    """
+    Video row theo path; path mới nhưng cùng fingerprint với video đã có thì dùng lại row đó
+    (kèm index reads của nó) thay vì tạo row mới
+    """
+    known = session.info.get('videos_by_path')
+    if known is not None and video_path in known:
+        db_video = known[video_path]
+    else:
+        db_video = session.query(DbVideo).filter_by(path=video_path).one_or_none()
+    if db_video:
+        changed = False
+        if fingerprint and db_video.content_hash != fingerprint:
+            db_video.content_hash = fingerprint  # File tại path này đã bị thay
+            db_video.sha1 = None
+            changed = True
+        if db_video.fps is None and fps:
+            db_video.fps = fps  # Row tạo sẵn lúc upload
+            changed = True
+        if changed:
+            session.commit()
+        return db_video
+    if fingerprint:
+        db_video = session.query(DbVideo).filter_by(content_hash=fingerprint).first()
+        if db_video:
+            print(f"♻️ {video_path} trùng nội dung với video #{db_video.video_id} ({db_video.path})")
+            return db_video
+    db_video = DbVideo(path=video_path, fps=fps, content_hash=fingerprint)
+    session.add(db_video)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Worker / job khác vừa tạo row cho cùng path
+        session.rollback()
+        db_video = session.query(DbVideo).filter_by(path=video_path).one()
+    return db_video
+
+
+def _prefetch_videos(session, video_paths: List[str], chunk: int = 500):
+    """Load Video rows của mọi path trong vài query (thay vì filter_by(path=...) từng file)"""
+    known = session.info.setdefault('videos_by_path', {})
+    for i in range(0, len(video_paths), chunk):
+        for db_video in session.query(DbVideo).filter(DbVideo.path.in_(video_paths[i:i + chunk])):
+            known[db_video.path] = db_video
+
+
+def dedupe_upload(path: str, db_path: str = 'db/vjts.sqlite', config_path: str | None = None,
+                  sha1: Optional[str] = None) -> Optional[str]:
+    """
+    File vừa upload trùng nội dung với một video đã biết: thay file bằng hard link tới bản cũ
+    (không lưu hai lần) và trả về path bản cũ; None nếu không trùng
+
+    Fingerprint chỉ lấy mẫu vài block nên chỉ dùng để tìm ứng viên; file chỉ bị thay khi
+    SHA1 toàn bộ (sha1 tính lúc upload so với Video.sha1) hoặc so sánh từng byte khớp.
+    Gọi từ thread riêng (đọc file + DB), không gọi trên event loop.
+    """
+    st = {'dedup': _dedup_settings(load_config(config_path))}
+    fingerprint = _fingerprint(st, path)
+    if not fingerprint:
+        return None
+    session = init_db(db_path)()
+    try:
+        for db_video in session.query(DbVideo).filter(DbVideo.content_hash == fingerprint).all():
+            existing = db_video.path
+            if existing == path or not os.path.exists(existing):
+                continue
+            if _fingerprint(st, existing) != fingerprint:
+                continue  # Bản cũ đã bị sửa
+            if sha1 and db_video.sha1:
+                same = db_video.sha1 == sha1
+            else:
+                same = filecmp.cmp(existing, path, shallow=False)
+                if same and sha1:
+                    db_video.sha1 = sha1
+                    session.commit()
+            if not same:
+                continue
+            tmp = path + '.link'
+            try:
+                os.link(existing, tmp)
+                os.replace(tmp, path)
+            except OSError:
+                # Khác filesystem: giữ bản copy, index vẫn dùng chung qua fingerprint
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            return existing
+
+        # Không trùng: tạo sẵn Video row kèm SHA1 để lần upload sau xác nhận trùng không cần đọc lại file
+        if sha1 and session.query(DbVideo).filter_by(path=path).one_or_none() is None:
+            session.add(DbVideo(path=path, content_hash=fingerprint, sha1=sha1))
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+        return None
+    finally:
+        session.close()
+
+
+def _analyze_video(video_path: str,
+                   targets: List[str],
+                   st: Dict[str, Any],
+                   session,
+                   get_models: Callable[[], tuple],
+                   index_key: Optional[str],
+                   output_dir: str,
+                   annotate: bool,
+                   on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   on_crop: Optional[Callable[[bytes], None]] = None,
+                   cancellation_flag: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """
+    Quét (hoặc phát lại từ index) một video và match với mọi biển số đích
+    
+    Returns:
+        Dict with video_path, video_id, fps, duration, annotated_path and
+        'segments' = {plate: raw segments from SegmentAccumulator}
+    """
+    name = os.path.basename(video_path)
+    fps, duration = get_video_info(video_path)
+    matchers = [PlateMatcher(p, st['match_mode'], st['max_dist']) for p in targets]
+    segmenters = {
+        p: SegmentAccumulator(fps=fps, lost_tolerance=st['lost'], pixel_to_meter=st['pixel_to_meter'], frame_skip=st['frame_skip'])
+        for p in targets
+    }
+    consensus = None
+    if st['consensus'].get('enabled'):
+        consensus = PlateConsensus(
+            iou_threshold=st['consensus'].get('iou_threshold', 0.3),
+            max_gap=st['lost'] * st['frame_step'],
+            min_reads=st['consensus'].get('min_reads', 1),
+        )
+    annotated_path = None
+    if on_event:
+        on_event({'type': 'video_start', 'path': video_path, 'fps': fps, 'duration': duration})
+
+    # Lưu detection results để annotate sau (các cửa sổ segment, hoặc cả video với mode full)
+    detections_map = {}  # {frame_idx: [(x1, y1, x2, y2, text, is_matched), ...]}
+    if annotate:
+        os.makedirs(os.path.join(output_dir, 'annotated'), exist_ok=True)
+        annotated_path = os.path.join(output_dir, 'annotated', os.path.splitext(name)[0] + '_annot.mp4')
+
+    # persist video
+    fingerprint = _fingerprint(st, video_path)
+    db_video = _get_or_create_video(session, video_path, fps, fingerprint)
+
+    # Trả lời từ index nếu video (hoặc một bản copy cùng nội dung) đã được quét với cùng model/tham số
+    index_entry = None
+    ranges = None
+    if st['use_index']:
+        index_entry = get_fresh_index(session, db_video.video_id, video_path, index_key, fingerprint)
+    recorder = None
+    if index_entry is not None:
+        if on_event:
+            on_event({'type': 'progress', 'message': f'⚡ Dùng index đã lưu ({index_entry.reads_count} reads), không decode lại video'})
+        frame_reads = replay_reads(session, index_entry)
+    elif st['coarse']['enabled']:
+        # Coarse-to-fine: pass thưa tìm khoảng ứng viên, pass dày chỉ trong các khoảng đó
+        detector, ocr_engine = get_models()
+        ranges = _coarse_ranges(video_path, targets, st, fps, detector, ocr_engine, on_event, cancellation_flag)
+        frame_reads = _iter_frame_reads(
+            video_path, detector, ocr_engine, **_scan_kwargs(st, on_event, cancellation_flag),
+            frame_skip=st['frame_step'],
+            ranges=ranges,
+        )
+    else:
+        detector, ocr_engine = get_models()
+        frame_reads = _iter_frame_reads(
+            video_path, detector, ocr_engine, **_scan_kwargs(st, on_event, cancellation_flag),
+            frame_skip=st['frame_skip'],
+        )
+        if st['index_enabled']:
+            recorder = ReadRecorder(session, db_video.video_id, flush_size=st['index_flush_size'])
+
+    max_appearances = st['max_appearances']
+    stopped_early = False
+    prev_frame_idx = -1
+    for frame_idx, reads in frame_reads:
+        if cancellation_flag and cancellation_flag.is_set():
+            break
+        if ranges and prev_frame_idx >= 0 and frame_idx - prev_frame_idx > st['frame_step']:
+            # Nhảy qua khoảng mà pass thưa không thấy biển số: coi như không match ngay trước frame này
+            for segmenter in segmenters.values():
+                segmenter.update(frame_idx - st['frame_step'], False)
+        prev_frame_idx = frame_idx
+        if recorder is not None:
+            recorder.record(frame_idx, reads)
+        if consensus is not None:
+            # Match trên chuỗi vote từ mọi read của cùng biển số, không phải một read nhiễu
+            reads = consensus.update(frame_idx, reads)
+        matches = _match_reads(matchers, reads)
+        matched_reads = {id(read): read for read in matches.values()}
+
+        if not st['use_batch'] and on_event and reads and frame_idx % 10 == 0:
+            on_event({'type': 'progress', 'frame': frame_idx, 'matched': bool(matches)})
+
+        if on_crop:
+            for (_, roi, _, _) in matched_reads.values():
+                if roi is None:  # Read phát lại từ index không có ảnh
+                    continue
+                try:
+                    import cv2
+                    ok, buf = cv2.imencode('.jpg', roi)
+                    if ok:
+                        on_crop(bytes(buf))
+                except Exception:
+                    pass
+
+        # Lưu detections vào map
+        if annotate and reads:
+            frame_detections = []
+            for read in reads:
+                (x1, y1, x2, y2, _), _, text, _ = read
+                frame_detections.append((x1, y1, x2, y2, text or '', id(read) in matched_reads))
+            detections_map[frame_idx] = frame_detections
+
+        # Update segmenter của từng biển số với bbox để tính trajectory
+        for target, segmenter in segmenters.items():
+            hit = matches.get(target)
+            if hit:
+                (x1, y1, x2, y2, score), _, _, confs = hit
+                segmenter.update(frame_idx, True, (x1, y1, x2, y2), score, plate_score(confs))
+            else:
+                segmenter.update(frame_idx, False)
+
+        # Early exit: mọi biển số đã có đủ N segment hoàn chỉnh -> ngừng decode video
+        if max_appearances and all(len(seg.segments) >= max_appearances for seg in segmenters.values()):
+            stopped_early = True
+            if on_event:
+                on_event({'type': 'progress', 'message': f'⏹️ Đã đủ {max_appearances} lần xuất hiện, dừng quét tại frame {frame_idx}'})
+            break
+    # Giải phóng decode/pipeline ngay khi dừng sớm
+    close = getattr(frame_reads, 'close', None)
+    if close is not None:
+        close()
+
+    if recorder is not None:
+        if stopped_early or (cancellation_flag and cancellation_flag.is_set()):
+            recorder.discard()  # Index chỉ lưu khi đã quét hết video
+        else:
+            recorder.commit(video_path, index_key, st['frame_step'], fingerprint)
+
+    file_segments = {p: seg.finalize() for p, seg in segmenters.items()}
+    if max_appearances:
+        file_segments = {p: segs[:max_appearances] for p, segs in file_segments.items()}
+
+    # Mode segments: chỉ vẽ các cửa sổ segment (đã pad), mỗi cửa sổ thành một clip cho concat
+    clips: Dict[str, List[Optional[str]]] = {}
+    if annotate and st['annotate_mode'] == 'segments' and not (cancellation_flag and cancellation_flag.is_set()):
+        rendered: Dict[tuple, Optional[str]] = {}
+        for target, plate_segments in file_segments.items():
+            clips[target] = [None] * len(plate_segments)
+            # Cửa sổ gộp giống bước merge trước concat -> một clip cho các segment gần nhau
+            windows = merge_segments([
+                dict(zip(('start_time', 'end_time'), _pad_window(seg, st['pre_pad'], st['post_pad'], duration)),
+                     video_path=video_path)
+                for seg in plate_segments
+            ], st['merge_gap'])
+            for merged in windows:
+                window = (merged['start_time'], merged['end_time'])
+                if window not in rendered:
+                    clip_path = os.path.join(output_dir, 'annotated',
+                                             f'{os.path.splitext(name)[0]}_annot_{window[0]:.2f}-{window[1]:.2f}.mp4')
+                    try:
+                        rendered[window] = annotate_segment(video_path, clip_path, detections_map, fps,
+                                                            window[0], window[1], st['frame_step'])
+                    except Exception as e:
+                        print(f"⚠️ Lỗi khi annotate segment {window[0]:.2f}-{window[1]:.2f}s: {e}")
+                        rendered[window] = None
+                for i in merged['sources']:
+                    clips[target][i] = rendered[window]
+        if rendered and on_event:
+            on_event({'type': 'progress', 'message': f'🎨 Đã annotate {len(rendered)} đoạn video'})
+        detections_map = {}
+    
+    # Tạo video annotated nếu có detections
+    if annotate and detections_map:
+        if on_event:
+            on_event({'type': 'progress', 'message': '🎨 Đang tạo video annotated...'})
+        try:
+            annotate_video_with_detections(video_path, annotated_path, detections_map, fps)
+            print(f"✅ Video annotated đã được tạo: {annotated_path}")
+        except Exception as e:
+            print(f"⚠️ Lỗi khi tạo video annotated: {e}")
+            annotated_path = None
+    else:
+        annotated_path = None
+
+    return {
+        'video_path': video_path,
+        'video_id': db_video.video_id,
+        'stopped_early': stopped_early,
+        'fps': fps,
+        'duration': duration,
+        'annotated_path': annotated_path,
+        'segments': file_segments,
+        'clips': clips,
+    }
+
+
+def _pad_window(segment: Dict[str, Any], pre_pad: float, post_pad: float, duration: float) -> tuple:
+    """Cửa sổ (start, end) giây của segment sau khi pad, giới hạn trong video"""
+    start_time = max(0.0, segment['start_time'] - pre_pad)
+    end_time = min(duration, segment['end_time'] + post_pad)
+    return start_time, end_time
+
+
+def _persist_video_segments(writer: AppearanceWriter, result: Dict[str, Any], match_mode: str,
+                            pre_pad: float, post_pad: float) -> Dict[str, List[Dict[str, Any]]]:
+    """Pad segments của một video, đưa Appearance rows vào writer và trả về segments cho JSON/concat theo biển số"""
+    video_path = result['video_path']
+    annotated_path = result['annotated_path']
+    duration = result['duration']
+    clips = result.get('clips') or {}
+    padded: Dict[str, List[Dict[str, Any]]] = {}
+    for target, plate_segments in result['segments'].items():
+        padded[target] = []
+        target_clips = clips.get(target) or []
+        for i, s in enumerate(plate_segments):
+            # Lấy trajectory data nếu có
+            trajectory_data = s.get('trajectory') or {}
+            start_time, end_time = _pad_window(s, pre_pad, post_pad, duration)
+            
+            padded[target].append({
+                # Dùng video annotated nếu có (khi annotate=True), nếu không dùng video gốc
+                'video_path': annotated_path if annotated_path else video_path,
+                'start_time': start_time,
+                'end_time': end_time,
+                'trajectory': trajectory_data,  # Thêm trajectory vào segments
+            })
+            if i < len(target_clips) and target_clips[i]:
+                # Clip annotated đúng bằng cửa sổ này -> concat dùng nguyên clip
+                padded[target][-1]['clip_path'] = target_clips[i]
+            
+            # Lưu vào database với trajectory data (mọi row cùng tập cột cho executemany)
+            writer.add({
+                'plate': normalize(target),
+                'camera_id': None,
+                'video_id': result['video_id'],
+                'start_time': start_time,
+                'end_time': end_time,
+                'score_lp': s.get('score_lp'),
+                'score_ocr': s.get('score_ocr'),
+                'match_mode': match_mode,
+                'speed_px_per_sec': trajectory_data.get('speed_px_per_sec'),
+                'speed_kmh': trajectory_data.get('speed_kmh'),
+                'direction_deg': trajectory_data.get('direction_deg'),
+                'direction_name': trajectory_data.get('direction_name'),
+                'total_distance_px': trajectory_data.get('total_distance_px'),
+            }, padded[target][-1])
+    return padded
+
+
+# State của worker process (mode song song): models + DB session riêng cho từng process
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(st: Dict[str, Any], db_path: str, num_threads: int, events, cancel_event):
+    """Initializer của process pool: giới hạn số thread CPU, mở DB session"""
+    torch.set_num_threads(max(1, num_threads))
+    try:
+        import cv2
+        cv2.setNumThreads(max(1, num_threads))
+    except Exception:
+        pass
+    # Mỗi worker load model một lần và giữ cho các video sau
+    _worker.update(st=st, session=init_db(db_path)(), events=events, cancel=cancel_event,
+                   get_models=_model_loader(st))
+
+
+def _analyze_video_in_worker(video_path: str, targets: List[str], index_key: Optional[str],
+                             output_dir: str, annotate: bool) -> Dict[str, Any]:
+    events = _worker['events']
+    return _analyze_video(
+        video_path, targets, _worker['st'], _worker['session'], _worker['get_models'], index_key, output_dir, annotate,
+        on_event=lambda evt: events.put(('event', evt)),
+        on_crop=lambda buf: events.put(('crop', buf)),
+        cancellation_flag=_worker['cancel'],
+    )
+
+
+def _analyze_videos_parallel(video_paths: List[str],
+                             targets: List[str],
+                             st: Dict[str, Any],
+                             db_path: str,
+                             index_key: Optional[str],
+                             output_dir: str,
+                             annotate: bool,
+                             on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                             on_crop: Optional[Callable[[bytes], None]] = None,
+                             cancellation_flag: Optional[threading.Event] = None,
+                             skip: Optional[Callable[[str], bool]] = None):
+    """
+    Phân video cho process pool; events/crops của worker được chuyển về on_event/on_crop
+    của process cha và cancellation_flag được chuyển tới các worker
+    
+    Args:
+        skip: Called after each result; videos still queued for which it returns True are cancelled
+    
+    Yields:
+        Results of _analyze_video in completion order
+    """
+    workers = min(st['workers'], len(video_paths))
+    threads = st['threads_per_worker'] or max(1, (os.cpu_count() or 1) // workers)
+    ctx = multiprocessing.get_context('spawn')
+    manager = ctx.Manager()
+    events = manager.Queue()
+    cancel_event = manager.Event()
+    stop = threading.Event()
+
+    def pump():
+        while True:
+            if cancellation_flag and cancellation_flag.is_set():
+                cancel_event.set()
+            try:
+                kind, payload = events.get(timeout=0.2)
+            except queue.Empty:
+                if stop.is_set():
+                    break
+                continue
+            if kind == 'event' and on_event:
+                on_event(payload)
+            elif kind == 'crop' and on_crop:
+                on_crop(payload)
+
+    pump_thread = threading.Thread(target=pump, name='vjts-events', daemon=True)
+    pump_thread.start()
+    print(f"⚙️ Parallel mode: {workers} worker processes x {threads} threads")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(st, db_path, threads, events, cancel_event)) as pool:
+            futures = {pool.submit(_analyze_video_in_worker, path, targets, index_key, output_dir, annotate): path
+                       for path in video_paths}
+            for fut in as_completed(futures):
+                if fut.cancelled():
+                    continue
+                yield fut.result()
+                if skip:
+                    for other, path in futures.items():
+                        if not other.done() and skip(path):
+                            other.cancel()  # Chỉ hủy được video chưa bắt đầu
+    finally:
+        stop.set()
+        pump_thread.join()
+        manager.shutdown()
+
+
+def run_job(plate: str,
+            video_dir: str,
+            output_dir: str,
+            config_path: str | None = None,
+            annotate: bool = False,
+            ffmpeg_path: str | None = None,
+            db_path: str = 'db/vjts.sqlite',
+            on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+            on_crop: Optional[Callable[[bytes], None]] = None,
+            cancellation_flag: Optional[threading.Event] = None,
+            max_appearances: Optional[int] = None,
+            first_per_camera: Optional[bool] = None) -> Dict[str, Any]:
+    res = run_watchlist_job([plate], video_dir, output_dir, config_path, annotate, ffmpeg_path, db_path,
+                            on_event, on_crop, cancellation_flag,
+                            max_appearances=max_appearances, first_per_camera=first_per_camera)
+    if res.get('error'):
+        return res
+    return res['results'][plate]
+
+
+def run_watchlist_job(plates: List[str],
+                      video_dir: str,
+                      output_dir: str,
+                      config_path: str | None = None,
+                      annotate: bool = False,
+                      ffmpeg_path: str | None = None,
+                      db_path: str = 'db/vjts.sqlite',
+                      on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                      on_crop: Optional[Callable[[bytes], None]] = None,
+                      cancellation_flag: Optional[threading.Event] = None,
+                      max_appearances: Optional[int] = None,
+                      first_per_camera: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Search a watchlist of plates with a single detection + OCR pass over the videos
+    
+    Every OCR read is matched against all target plates; each plate gets its own
+    segments, JSON file, result video, Appearance rows and Job row.
+    
+    Args:
+        max_appearances: Stop decoding a video once every plate has this many finalized
+            segments in it (None = search.max_appearances from config, 0 = scan everything)
+        first_per_camera: Skip the remaining videos of a camera once every plate was seen
+            there (None = search.first_per_camera from config)
+    
+    Returns:
+        Dict with 'results' mapping each plate to the same dict run_job returns
+    """
+    # Dedupe theo biển số đã normalize, giữ thứ tự watchlist
+    targets: List[str] = []
+    seen = set()
+    for p in plates:
+        key = normalize(p)
+        if key and key not in seen:
+            seen.add(key)
+            targets.append(p)
+    if not targets:
+        raise ValueError('Watchlist không có biển số hợp lệ')
+
+    st = _resolve_settings(load_config(config_path))
+    if max_appearances is not None:
+        st['max_appearances'] = int(max_appearances)
+    if first_per_camera is not None:
+        st['first_per_camera'] = bool(first_per_camera)
+    if st['first_per_camera'] and not st['max_appearances']:
+        st['max_appearances'] = 1  # Chỉ cần lần xuất hiện đầu tiên trong mỗi video
+    conf = st['conf']
+    match_mode = st['match_mode']
+    pre_pad = st['pre_pad']
+    post_pad = st['post_pad']
+
     os.makedirs(output_dir, exist_ok=True)
     if on_event:
-        on_event({'type': 'status', 'stage': 'start', 'video_dir': video_dir})
+        on_event({'type': 'status', 'stage': 'start', 'video_dir': video_dir, 'plates': targets})
+
+    # Models chỉ được lấy từ pool khi thật sự phải quét video (video đã index thì không cần)
+    get_models = _model_loader(st)
+
+    index_key = None
+    if st['index_enabled'] or st['use_index']:
+        index_key = make_index_key(model_fingerprint([LicensePlateDetector.model_path, OcrEngine.model_path]),
+                                   conf, st['frame_step'], variant=_index_variant(st))
 
-    # Initialize models with GPU support
-    detector = LicensePlateDetector(conf_threshold=conf, use_gpu=gpu_enabled)
-    ocr_engine = OcrEngine(conf_threshold=0.60, use_gpu=gpu_enabled)
     Session = init_db(db_path)
     session = Session()
 
-    segments: List[Dict[str, Any]] = []
-    
     # Check cancellation at start
     if cancellation_flag and cancellation_flag.is_set():
         if on_event:
             on_event({'type': 'cancelled', 'message': 'Job đã bị hủy trước khi bắt đầu'})
+        session.close()
         return {'error': 'cancelled', 'message': 'Job đã bị hủy'}
 
-    for root, _, files in os.walk(video_dir):
-        # Check cancellation before processing each video
-        if cancellation_flag and cancellation_flag.is_set():
-            if on_event:
-                on_event({'type': 'cancelled', 'message': 'Job đã bị hủy'})
-            break
-            
-        for name in files:
-            if not name.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
-                continue
-            video_path = os.path.join(root, name)
-            fps, duration = get_video_info(video_path)
-            segmenter = SegmentAccumulator(fps=fps, lost_tolerance=lost, pixel_to_meter=pixel_to_meter, frame_skip=frame_skip)
-            annotated_path = None
+    video_paths = _dedupe_videos(_list_videos(video_dir), st, on_event)
+    _prefetch_videos(session, video_paths)
+
+    # first_per_camera: camera -> các biển số đã thấy; camera đủ mọi biển số thì bỏ qua video còn lại
+    camera_hits: Dict[str, set] = {}
+
+    def camera_done(video_path: str) -> bool:
+        if not st['first_per_camera']:
+            return False
+        return len(camera_hits.get(_camera_of(video_dir, video_path), ())) >= len(targets)
+
+    if st['workers'] > 1 and len(video_paths) > 1:
+        # Mỗi worker process có model riêng; DB writes và events gom về process cha
+        video_results = _analyze_videos_parallel(
+            video_paths, targets, st, db_path, index_key, output_dir, annotate,
+            on_event=on_event, on_crop=on_crop, cancellation_flag=cancellation_flag,
+            skip=camera_done,
+        )
+    else:
+        video_results = (
+            _analyze_video(video_path, targets, st, session, get_models, index_key, output_dir, annotate,
+                           on_event=on_event, on_crop=on_crop, cancellation_flag=cancellation_flag)
+            for video_path in video_paths
+            if not (cancellation_flag and cancellation_flag.is_set()) and not camera_done(video_path)
+        )
+
+    per_video: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    writer = AppearanceWriter(session, batch_size=st['db_batch_size'])
+    try:
+        for result in video_results:
+            per_video[result['video_path']] = _persist_video_segments(writer, result, match_mode, pre_pad, post_pad)
+            # Ghi appearance của video vừa xong ngay (một transaction / video): job lỗi giữa chừng
+            # không làm mất kết quả các video đã phân tích xong
+            writer.commit()
+            camera_hits.setdefault(_camera_of(video_dir, result['video_path']), set()).update(
+                p for p, segs in result['segments'].items() if segs
+            )
             if on_event:
-                on_event({'type': 'video_start', 'path': video_path, 'fps': fps, 'duration': duration})
-
-            # Lưu detection results để annotate sau
-            detections_map = {}  # {frame_idx: [(x1, y1, x2, y2, text, is_matched), ...]}
-            if annotate:
-                os.makedirs(os.path.join(output_dir, 'annotated'), exist_ok=True)
-                annotated_path = os.path.join(output_dir, 'annotated', os.path.splitext(name)[0] + '_annot.mp4')
-
-            # Use batch processing if GPU is enabled
-            if gpu_enabled and gpu_batch_size > 1:
-                # Batch processing mode
-                batch_num = 0
-                frames_processed = 0
-                
-                for batch_indices, batch_frames in iterate_frames_batch(video_path, batch_size=gpu_batch_size, frame_skip=frame_skip):
-                    # Check cancellation before each batch
-                    if cancellation_flag and cancellation_flag.is_set():
-                        if on_event:
-                            on_event({'type': 'cancelled', 'message': 'Job đã bị hủy'})
-                        break
-                    
-                    batch_num += 1
-                    start_idx = batch_indices[0] if batch_indices else 0
-                    end_idx = batch_indices[-1] if batch_indices else 0
-                    
-                    if on_event:
-                        on_event({'type': 'progress', 'message': f'🚀 Processing batch {batch_num}, frames {start_idx}-{end_idx}'})
-                    
-                    # Batch detect
-                    try:
-                        batch_boxes = detector.detect_batch(batch_frames)
-                    except RuntimeError as e:
-                        if 'out of memory' in str(e).lower():
-                            print(f"⚠️ GPU OOM, reducing batch size and retrying...")
-                            clear_gpu_cache()
-                            # Reduce batch size by half
-                            new_batch_size = max(1, gpu_batch_size // 2)
-                            print(f"⚠️ Retrying with batch size: {new_batch_size}")
-                            # Process remaining frames with smaller batch
-                            batch_boxes = []
-                            for frame in batch_frames:
-                                boxes = detector.detect(frame)
-                                batch_boxes.append(boxes)
-                        else:
-                            raise
-                    
-                    # Process each frame in batch
-                    # Tối ưu: giảm CPU overhead
-                    for i, (frame_idx, frame, boxes) in enumerate(zip(batch_indices, batch_frames, batch_boxes)):
-                        matched = False
-                        matched_bbox = None  # Lưu bbox của biển số đã match để tính trajectory
-                        frame_detections = []  # Lưu detections cho frame này
-                        
-                        # Process OCR - tối ưu để giảm CPU overhead
-                        for (x1, y1, x2, y2, score) in boxes:
-                            # Chỉ crop ROI khi cần
-                            roi = frame[int(y1):int(y2), int(x1):int(x2)]
-                            if roi.size == 0:  # Skip empty ROI
-                                continue
-                            
-                            text = ocr_engine.read_text(roi)
-                            is_matched_box = text and is_match(plate, text, match_mode, max_dist)
-                            
-                            if is_matched_box:
-                                if on_crop:
-                                    try:
-                                        import cv2
-                                        ok, buf = cv2.imencode('.jpg', roi)
-                                        if ok:
-                                            on_crop(bytes(buf))
-                                    except Exception:
-                                        pass
-                                
-                                matched = True
-                                matched_bbox = (x1, y1, x2, y2)  # Lưu bbox để tính trajectory
-                            
-                            # Lưu detection để annotate sau
-                            if annotate:
-                                frame_detections.append((x1, y1, x2, y2, text or '', is_matched_box))
-                            
-                            if matched:
-                                break
-                        
-                        # Lưu detections vào map
-                        if annotate and frame_detections:
-                            detections_map[frame_idx] = frame_detections
-                        
-                        # Update segmenter với bbox để tính trajectory
-                        segmenter.update(frame_idx, matched, matched_bbox if matched else None)
-                        
-                        frames_processed += 1
-                    
-                    # Clear GPU cache periodically (less frequent to keep GPU busy)
-                    if frames_processed % clear_cache_interval == 0:
-                        clear_gpu_cache()
-                        if on_event:
-                            on_event({'type': 'progress', 'message': f'🧹 Cleared GPU cache at frame {frames_processed}'})
-            else:
-                # Single frame processing (CPU mode or batch_size=1)
-                for frame_idx, frame in iterate_frames(video_path):
-                    # Check cancellation before each frame
-                    if cancellation_flag and cancellation_flag.is_set():
-                        if on_event:
-                            on_event({'type': 'cancelled', 'message': 'Job đã bị hủy'})
-                        break
-                    
-                    boxes = detector.detect(frame)
-                    matched = False
-                    matched_bbox = None  # Lưu bbox để tính trajectory
-                    frame_detections = []  # Lưu detections cho frame này
-                    
-                    for (x1, y1, x2, y2, score) in boxes:
-                        roi = frame[int(y1):int(y2), int(x1):int(x2)]
-                        text = ocr_engine.read_text(roi)
-                        is_matched_box = text and is_match(plate, text, match_mode, max_dist)
-                        
-                        if on_event and frame_idx % 10 == 0:
-                            on_event({'type': 'progress', 'frame': frame_idx, 'matched': bool(is_matched_box)})
-                        
-                        if is_matched_box and on_crop:
-                            try:
-                                import cv2
-                                ok, buf = cv2.imencode('.jpg', roi)
-                                if ok:
-                                    on_crop(bytes(buf))
-                            except Exception:
-                                pass
-                        
-                        # Lưu detection để annotate sau
-                        if annotate:
-                            frame_detections.append((x1, y1, x2, y2, text or '', is_matched_box))
-                        
-                        if is_matched_box:
-                            matched = True
-                            matched_bbox = (x1, y1, x2, y2)  # Lưu bbox để tính trajectory
-                            break
-                    
-                    # Lưu detections vào map
-                    if annotate and frame_detections:
-                        detections_map[frame_idx] = frame_detections
-                    
-                    segmenter.update(frame_idx, matched, matched_bbox if matched else None)
-
-            file_segments = segmenter.finalize()
-            
-            # Tạo video annotated nếu có detections
-            if annotate and detections_map:
-                if on_event:
-                    on_event({'type': 'progress', 'message': '🎨 Đang tạo video annotated...'})
-                try:
-                    annotate_video_with_detections(video_path, annotated_path, detections_map, fps)
-                    print(f"✅ Video annotated đã được tạo: {annotated_path}")
-                except Exception as e:
-                    print(f"⚠️ Lỗi khi tạo video annotated: {e}")
-                    annotated_path = None
-            
-            # persist video
-            db_video = session.query(DbVideo).filter_by(path=video_path).one_or_none()
-            if not db_video:
-                db_video = DbVideo(path=video_path, fps=fps)
-                session.add(db_video)
-                session.commit()
-            for s in file_segments:
-                # Lấy trajectory data nếu có
-                trajectory_data = s.get('trajectory', {})
-                
-                segments.append({
-                    # Dùng video annotated nếu có (khi annotate=True), nếu không dùng video gốc
-                    'video_path': annotated_path if annotated_path else video_path,
-                    'start_time': max(0.0, s['start_time'] - pre_pad),
-                    'end_time': min(duration, s['end_time'] + post_pad),
-                    'trajectory': trajectory_data,  # Thêm trajectory vào segments
+                on_event({
+                    'type': 'video_done',
+                    'path': result['video_path'],
+                    'segments': sum(len(v) for v in result['segments'].values()),
+                    'segments_by_plate': {p: len(v) for p, v in result['segments'].items()},
                 })
-                
-                # Lưu vào database với trajectory data
-                appearance = DbAppearance(
-                    plate=normalize(plate),
-                    camera_id=None,
-                    video_id=db_video.video_id,
-                    start_time=max(0.0, s['start_time'] - pre_pad),
-                    end_time=min(duration, s['end_time'] + post_pad),
-                    score_lp=None,
-                    score_ocr=None,
-                    match_mode=match_mode,
-                )
-                
-                # Thêm trajectory data nếu có
-                if trajectory_data:
-                    appearance.speed_px_per_sec = trajectory_data.get('speed_px_per_sec')
-                    appearance.speed_kmh = trajectory_data.get('speed_kmh')
-                    appearance.direction_deg = trajectory_data.get('direction_deg')
-                    appearance.direction_name = trajectory_data.get('direction_name')
-                    appearance.total_distance_px = trajectory_data.get('total_distance_px')
-                
-                session.add(appearance)
-            session.commit()
-            
-            if on_event:
-                on_event({'type': 'video_done', 'path': video_path, 'segments': len(file_segments)})
+    finally:
+        # Cắt / ghép không cần model -> trả về pool cho job khác ngay
+        get_models.release()
+
+    # Gộp segments theo thứ tự video (mode song song trả kết quả theo thứ tự xong)
+    segments: Dict[str, List[Dict[str, Any]]] = {p: [] for p in targets}
+    for video_path in video_paths:
+        for target, plate_segments in per_video.get(video_path, {}).items():
+            segments[target].extend(plate_segments)
+    total_segments = sum(len(v) for v in segments.values())
 
     # Check if cancelled before finalizing
     if cancellation_flag and cancellation_flag.is_set():
         if on_event:
             on_event({'type': 'cancelled', 'message': 'Job đã bị hủy'})
         session.close()
-        return {'error': 'cancelled', 'message': 'Job đã bị hủy', 'segments_count': len(segments)}
+        return {'error': 'cancelled', 'message': 'Job đã bị hủy', 'segments_count': total_segments}
     
     timestamp = datetime.now().strftime('%Y-%m-%d-%H%M%S')
-    norm_plate = normalize(plate).replace('-', '')
-    result_json_path = os.path.join(output_dir, f'VJTS_{norm_plate}_{timestamp}.json')
-    with open(result_json_path, 'w', encoding='utf-8') as f:
-        json.dump({ 'plate': plate, 'segments': segments }, f, ensure_ascii=False, indent=2)
+    results: Dict[str, Dict[str, Any]] = {}
+    for plate in targets:
+        plate_segments = segments[plate]
+        norm_plate = normalize(plate).replace('-', '')
+        result_json_path = os.path.join(output_dir, f'VJTS_{norm_plate}_{timestamp}.json')
+        # Gộp các đoạn chồng lấn / sát nhau trong cùng video trước khi cắt
+        merged_segments = merge_segments(plate_segments, st['merge_gap'])
+        with open(result_json_path, 'w', encoding='utf-8') as f:
+            json.dump({ 'plate': plate, 'segments': plate_segments, 'merged_segments': merged_segments },
+                      f, ensure_ascii=False, indent=2)
 
-    output_video_path = None
-    if segments:
-        try:
-            output_video_path = os.path.join(output_dir, f'VJTS_{norm_plate}_{timestamp}.mp4')
-            concat_segments(segments, output_video_path, ffmpeg_path=ffmpeg_path or None)
-            if on_event:
-                on_event({'type': 'concat_done', 'output': output_video_path})
-        except Exception as e:
-            output_video_path = None
-            if on_event:
-                on_event({'type': 'concat_error', 'message': str(e)})
-
-    # persist job
-    job_id = f"JOB-{norm_plate}-{timestamp}"
-    session.add(DbJob(
-        job_id=job_id,
-        plate=normalize(plate),
-        status='done',
-        created_at=datetime.now(),
-        finished_at=datetime.now(),
-        result_video=output_video_path,
-        segments_json=result_json_path,
-    ))
+        output_video_path = None
+        if merged_segments:
+            try:
+                output_video_path = os.path.join(output_dir, f'VJTS_{norm_plate}_{timestamp}.mp4')
+                concat_segments(merged_segments, output_video_path, ffmpeg_path=ffmpeg_path or None,
+                                mode=st['concat']['mode'], max_workers=st['concat']['max_workers'],
+                                threads_per_ffmpeg=st['concat']['threads_per_ffmpeg'])
+                if on_event:
+                    on_event({'type': 'concat_done', 'output': output_video_path, 'plate': plate})
+            except Exception as e:
+                output_video_path = None
+                if on_event:
+                    on_event({'type': 'concat_error', 'message': str(e), 'plate': plate})
+
+        # persist job
+        job_id = f"JOB-{norm_plate}-{timestamp}"
+        session.add(DbJob(
+            job_id=job_id,
+            plate=normalize(plate),
+            status='done',
+            created_at=datetime.now(),
+            finished_at=datetime.now(),
+            result_video=output_video_path,
+            segments_json=result_json_path,
+        ))
+        results[plate] = {
+            'job_id': job_id,
+            'plate': plate,
+            'segments_json': result_json_path,
+            'result_video': output_video_path,
+            'segments_count': len(plate_segments),
+            'segments': plate_segments,  # Include segments for time sync
+            'merged_segments': merged_segments,  # Các đoạn thực sự được cắt vào video kết quả
+        }
     session.commit()
     session.close()
 
@@ -404,12 +1243,71 @@ def run_job(plate: str,
         on_event({'type': 'done'})
 
     return {
-        'job_id': job_id,
-        'plate': plate,
-        'segments_json': result_json_path,
-        'result_video': output_video_path,
-        'segments_count': len(segments),
-        'segments': segments,  # Include segments for time sync
+        'plates': targets,
+        'results': results,
+        'segments_count': total_segments,
     }
 
 
+def run_index_job(video_dir: str,
+                  config_path: str | None = None,
+                  db_path: str = 'db/vjts.sqlite',
+                  on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  on_crop: Optional[Callable[[bytes], None]] = None,
+                  cancellation_flag: Optional[threading.Event] = None,
+                  video_paths: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Quét video_dir và lưu mọi OCR read vào index, không match biển số nào
+    
+    Video đã có index còn mới được bỏ qua. Sau đó run_job/run_watchlist_job trên
+    cùng thư mục trả lời hoàn toàn từ index. video_paths: chỉ index các file này
+    (ví dụ file vừa upload xong) thay vì cả thư mục. on_crop không được dùng (index
+    không match nên không có crop), chỉ để JobManager gọi như các job khác.
+    """
+    st = _resolve_settings(load_config(config_path))
+    index_key = make_index_key(model_fingerprint([LicensePlateDetector.model_path, OcrEngine.model_path]),
+                               st['conf'], st['frame_step'], variant=_index_variant(st))
+    Session = init_db(db_path)
+    session = Session()
+    get_models = _model_loader(st)
+    indexed, skipped, total_reads = 0, 0, 0
+
+    if on_event:
+        on_event({'type': 'status', 'stage': 'index_start', 'video_dir': video_dir})
+
+    with get_models:
+        video_paths = _dedupe_videos(video_paths if video_paths is not None else _list_videos(video_dir), st)
+        _prefetch_videos(session, video_paths)
+        for video_path in video_paths:
+            if cancellation_flag and cancellation_flag.is_set():
+                break
+            fps, _ = get_video_info(video_path)
+            fingerprint = _fingerprint(st, video_path)
+            db_video = _get_or_create_video(session, video_path, fps, fingerprint)
+            if get_fresh_index(session, db_video.video_id, video_path, index_key, fingerprint) is not None:
+                skipped += 1
+                continue
+
+            detector, ocr_engine = get_models()
+            if on_event:
+                on_event({'type': 'video_start', 'path': video_path, 'fps': fps})
+            recorder = ReadRecorder(session, db_video.video_id, flush_size=st['index_flush_size'])
+            for frame_idx, reads in _iter_frame_reads(
+                    video_path, detector, ocr_engine, **_scan_kwargs(st, on_event, cancellation_flag),
+                    frame_skip=st['frame_skip']):
+                recorder.record(frame_idx, reads)
+            if cancellation_flag and cancellation_flag.is_set():
+                recorder.discard()
+                break
+            recorder.commit(video_path, index_key, st['frame_step'], fingerprint)
+            indexed += 1
+            total_reads += recorder.count
+            if on_event:
+                on_event({'type': 'video_done', 'path': video_path, 'reads': recorder.count})
+
+    session.close()
+    if cancellation_flag and cancellation_flag.is_set():
+        return {'error': 'cancelled', 'message': 'Job đã bị hủy', 'videos_indexed': indexed}
+    if on_event:
+        on_event({'type': 'done'})
+    return {'videos_indexed': indexed, 'videos_skipped': skipped, 'reads': total_reads}
@@ -0,0 +1,186 @@
+"""
+Track-then-read: gán box biển số qua các frame thành track (IoU + Kalman vận tốc không đổi),
+chỉ OCR mỗi track vài lần đầu hoặc khi box rõ hơn, và vote chuỗi biển số trên các lần đọc
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .ocr import plate_score
+
+
+def iou(a: Tuple[float, ...], b: Tuple[float, ...]) -> float:
+    """IoU của hai box (x1, y1, x2, y2, ...)"""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    if inter <= 0:
+        return 0.0
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """Một biển số vật lý: Kalman trên (cx, cy, w, h, vx, vy) + phiếu bầu OCR"""
+
+    # Ma trận Kalman dùng chung (bước thời gian = 1 frame được xử lý)
+    _F = np.eye(6)
+    _F[0, 4] = _F[1, 5] = 1.0
+    _H = np.eye(4, 6)
+    _Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.5, 0.5])
+    _R = np.diag([4.0, 4.0, 9.0, 9.0])
+
+    def __init__(self, track_id: int, box: Tuple[float, ...]):
+        self.track_id = track_id
+        self.x = np.zeros(6)
+        self.x[:4] = self._measure(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 100.0, 100.0])
+        self.misses = 0
+        self.hits = 1
+        self.ocr_count = 0  # Số lần OCR đã yêu cầu (tính cả read còn chờ kết quả trong batch)
+        self.best_score_lp = 0.0
+        self.votes: Dict[str, float] = {}
+        self.best_confs: Dict[str, Tuple[float, List[float]]] = {}  # text -> (score, confs)
+        self.text: Optional[str] = None
+
+    @staticmethod
+    def _measure(box: Tuple[float, ...]) -> np.ndarray:
+        x1, y1, x2, y2 = box[:4]
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=float)
+
+    def predict(self) -> Tuple[float, float, float, float]:
+        self.x = self._F @ self.x
+        self.P = self._F @ self.P @ self._F.T + self._Q
+        return self.box()
+
+    def correct(self, box: Tuple[float, ...]):
+        y = self._measure(box) - self._H @ self.x
+        S = self._H @ self.P @ self._H.T + self._R
+        K = self.P @ self._H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(6) - K @ self._H) @ self.P
+        self.misses = 0
+        self.hits += 1
+
+    def box(self) -> Tuple[float, float, float, float]:
+        cx, cy, w, h = self.x[:4]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2
+
+    def add_read(self, text: Optional[str], confs: List[float]):
+        """Thêm một lần OCR vào phiếu bầu (trọng số = độ tin cậy OCR trung bình)"""
+        if not text:
+            return
+        weight = plate_score(confs) or 1.0
+        self.votes[text] = self.votes.get(text, 0.0) + weight
+        if text not in self.best_confs or weight > self.best_confs[text][0]:
+            self.best_confs[text] = (weight, list(confs))
+        self.text = max(self.votes.items(), key=lambda kv: kv[1])[0]
+
+    def voted(self) -> Tuple[Optional[str], List[float]]:
+        """Chuỗi thắng phiếu hiện tại và char confidences tốt nhất của nó"""
+        if self.text is None:
+            return None, []
+        return self.text, self.best_confs[self.text][1]
+
+
+class PlateTracker:
+    def __init__(self,
+                 iou_threshold: float = 0.3,
+                 max_age: int = 10,
+                 max_reads: int = 3,
+                 min_improve: float = 0.05,
+                 max_extra_reads: int = 3):
+        """
+        Args:
+            iou_threshold: IoU tối thiểu giữa box dự đoán của track và box detect để ghép
+            max_age: Số frame được xử lý liên tiếp không thấy trước khi xóa track
+            max_reads: OCR mỗi track ở bấy nhiêu lần thấy đầu tiên
+            min_improve: Sau đó chỉ OCR lại khi detector score vượt best score của track bấy nhiêu
+            max_extra_reads: Số lần OCR lại tối đa do score tăng
+        """
+        self.iou_threshold = float(iou_threshold)
+        self.max_age = max(1, int(max_age))
+        self.max_reads = max(1, int(max_reads))
+        self.min_improve = float(min_improve)
+        self.max_extra_reads = max(0, int(max_extra_reads))
+        self.tracks: List[Track] = []
+        self.next_id = 1
+        self.boxes_seen = 0
+        self.ocr_calls = 0
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict]) -> Optional['PlateTracker']:
+        """Tạo tracker từ section tracking.tracker của config, None nếu tắt"""
+        if not cfg or not cfg.get('enabled'):
+            return None
+        return cls(
+            iou_threshold=cfg.get('iou_threshold', 0.3),
+            max_age=cfg.get('max_age', 10),
+            max_reads=cfg.get('max_reads', 3),
+            min_improve=cfg.get('min_improve', 0.05),
+            max_extra_reads=cfg.get('max_extra_reads', 3),
+        )
+
+    def update(self, boxes: List[Tuple[float, ...]]) -> List[Tuple[Track, bool]]:
+        """
+        Ghép box của một frame vào các track
+
+        Args:
+            boxes: Detector boxes (x1, y1, x2, y2, score) của frame
+
+        Returns:
+            (track, need_ocr) cho từng box, cùng thứ tự với boxes
+        """
+        predicted = [t.predict() for t in self.tracks]
+
+        # Greedy matching theo IoU giảm dần
+        pairs = []
+        for ti, pbox in enumerate(predicted):
+            for bi, box in enumerate(boxes):
+                score = iou(pbox, box)
+                if score >= self.iou_threshold:
+                    pairs.append((score, ti, bi))
+        pairs.sort(reverse=True)
+        box_track: Dict[int, Track] = {}
+        used_tracks = set()
+        for _, ti, bi in pairs:
+            if ti in used_tracks or bi in box_track:
+                continue
+            used_tracks.add(ti)
+            box_track[bi] = self.tracks[ti]
+            self.tracks[ti].correct(boxes[bi])
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_age]
+
+        out = []
+        for bi, box in enumerate(boxes):
+            track = box_track.get(bi)
+            if track is None:
+                track = Track(self.next_id, box)
+                self.next_id += 1
+                self.tracks.append(track)
+            score = float(box[4]) if len(box) > 4 else 0.0
+            need_ocr = track.ocr_count < self.max_reads or (
+                track.ocr_count < self.max_reads + self.max_extra_reads
+                and score >= track.best_score_lp + self.min_improve
+            )
+            if need_ocr:
+                # Đếm ngay khi quyết định: kết quả OCR chỉ về sau cả batch, các frame sau
+                # trong cùng batch phải thấy read đang chờ để không vượt max_reads
+                track.ocr_count += 1
+                track.best_score_lp = max(track.best_score_lp, score)
+                self.ocr_calls += 1
+            self.boxes_seen += 1
+            out.append((track, need_ocr))
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'tracks': self.next_id - 1,
+            'boxes': self.boxes_seen,
+            'ocr_calls': self.ocr_calls,
+        }
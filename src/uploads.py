@@ -0,0 +1,198 @@
+"""
+Upload streaming: đọc body multipart theo từng chunk và ghi thẳng xuống đĩa (không giữ cả
+file trong RAM), hash trong lúc ghi, giới hạn kích thước, báo từng file ngay khi upload xong
+"""
+import hashlib
+import inspect
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from anyio import to_thread
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+MAX_FIELD_BYTES = 1 << 20  # Field thường (plate, output_dir...) không cần lớn hơn
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def upload_settings(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Đọc section upload của config"""
+    up = cfg.get('upload', {}) or {}
+
+    def mb(key):
+        value = up.get(key)
+        return int(float(value) * (1 << 20)) if value else None
+
+    return {
+        'dir': up.get('dir', os.path.join('data', 'videos', 'uploads')),
+        'chunk_size': max(64 * 1024, int(float(up.get('chunk_size_kb', 1024)) * 1024)),
+        'hash': up.get('hash') or None,
+        'max_file_size': mb('max_file_size_mb'),
+        'max_total_size': mb('max_total_size_mb'),
+        'analyze_on_arrival': bool(up.get('analyze_on_arrival', True)),
+    }
+
+
+class _Part:
+    def __init__(self, name: str, filename: Optional[str]):
+        self.name = name
+        self.filename = filename
+        self.path: Optional[str] = None
+        self.fh = None
+        self.buf = bytearray()
+        self.size = 0
+        self.hasher = None
+
+
+async def receive_uploads(stream,
+                          content_type: str,
+                          upload_dir: str,
+                          chunk_size: int = 1 << 20,
+                          hash_name: Optional[str] = None,
+                          max_file_size: Optional[int] = None,
+                          max_total_size: Optional[int] = None,
+                          on_file: Optional[Callable[[Dict[str, Any]], None]] = None
+                          ) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """
+    Nhận một request multipart/form-data, ghi các file vào upload_dir trong lúc body đang tới
+
+    Args:
+        stream: Async iterator các chunk bytes của body (request.stream())
+        content_type: Header Content-Type (chứa boundary)
+        upload_dir: Thư mục lưu file
+        chunk_size: Gom dữ liệu tới bấy nhiêu byte rồi mới ghi xuống đĩa
+        hash_name: Thuật toán hashlib tính trong lúc ghi (None = không hash)
+        max_file_size: Giới hạn byte mỗi file (None = không giới hạn)
+        max_total_size: Giới hạn byte tổng các file của request
+        on_file: Gọi (hàm thường hoặc coroutine) với thông tin file ngay khi file đó ghi xong
+
+    Returns:
+        (fields, files): các field thường và [{'filename', 'path', 'size', hash_name?}, ...]
+    """
+    ctype, params = parse_options_header(content_type)
+    boundary = params.get(b'boundary')
+    if ctype != b'multipart/form-data' or not boundary:
+        raise ValueError('Cần Content-Type multipart/form-data')
+
+    events: List[tuple] = []
+    header = {'field': bytearray(), 'value': bytearray(), 'headers': {}}
+
+    def on_part_begin():
+        header['headers'] = {}
+
+    def on_header_field(data, start, end):
+        header['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header['value'] += data[start:end]
+
+    def on_header_end():
+        header['headers'][bytes(header['field']).lower()] = bytes(header['value'])
+        header['field'] = bytearray()
+        header['value'] = bytearray()
+
+    def on_headers_finished():
+        _, opts = parse_options_header(header['headers'].get(b'content-disposition', b''))
+        name = opts.get(b'name', b'').decode('utf-8', 'replace')
+        filename = opts.get(b'filename')
+        events.append(('begin', _Part(name, filename.decode('utf-8', 'replace') if filename is not None else None)))
+
+    def on_part_data(data, start, end):
+        events.append(('data', bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(('end', None))
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    fields: Dict[str, str] = {}
+    files: List[Dict[str, Any]] = []
+    state = {'part': None, 'total': 0}
+
+    async def flush(part: _Part):
+        if part.buf:
+            data = bytes(part.buf)
+            part.buf.clear()
+            await to_thread.run_sync(part.fh.write, data)
+
+    async def handle(kind: str, value):
+        part: Optional[_Part] = state['part']
+        if kind == 'begin':
+            part = state['part'] = value
+            if part.filename is not None:
+                name = os.path.basename(part.filename.replace('\\', '/')) or f'upload_{len(files)}'
+                part.path = os.path.join(upload_dir, name)
+                part.fh = await to_thread.run_sync(open, part.path, 'wb')
+                part.hasher = hashlib.new(hash_name) if hash_name else None
+        elif kind == 'data':
+            part.size += len(value)
+            if part.fh is None:
+                if part.size > MAX_FIELD_BYTES:
+                    raise UploadTooLarge(f'Field {part.name} quá lớn')
+                part.buf += value
+                return
+            state['total'] += len(value)
+            if max_file_size and part.size > max_file_size:
+                raise UploadTooLarge(f'File {part.filename} vượt quá {max_file_size} bytes')
+            if max_total_size and state['total'] > max_total_size:
+                raise UploadTooLarge(f'Tổng dung lượng upload vượt quá {max_total_size} bytes')
+            if part.hasher is not None:
+                part.hasher.update(value)
+            part.buf += value
+            if len(part.buf) >= chunk_size:
+                await flush(part)
+        elif kind == 'end':
+            state['part'] = None
+            if part.fh is None:
+                fields[part.name] = bytes(part.buf).decode('utf-8', 'replace')
+                return
+            await flush(part)
+            await to_thread.run_sync(part.fh.close)
+            part.fh = None
+            info = {'filename': part.filename, 'path': part.path, 'size': part.size}
+            if part.hasher is not None:
+                info[hash_name] = part.hasher.hexdigest()
+            files.append(info)
+            if on_file:
+                result = on_file(info)
+                if inspect.isawaitable(result):
+                    await result
+
+    try:
+        async for chunk in stream:
+            if chunk:
+                parser.write(chunk)
+            for kind, value in events:
+                await handle(kind, value)
+            events.clear()
+        parser.finalize()
+        for kind, value in events:
+            await handle(kind, value)
+        if state['part'] is not None:
+            raise ValueError('Upload bị ngắt giữa chừng')
+    except BaseException:
+        # Upload lỗi / client ngắt: bỏ file đang ghi dở
+        part = state['part']
+        if part is not None and part.fh is not None:
+            part.fh.close()
+            try:
+                os.remove(part.path)
+            except OSError:
+                pass
+        raise
+    return fields, files
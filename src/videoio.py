@@ -37,7 +37,8 @@ def iterate_frames(path: str):
         cap.release()
 
 
-def iterate_frames_batch(path: str, batch_size: int = 8, frame_skip: int = 2):
+def iterate_frames_batch(path: str, batch_size: int = 8, frame_skip: int = 2,
+                         decode_mode: str = 'grab', seek_min_skip: int = 60):
     """
     Iterate through video frames in batches (optimized for GPU processing)
     
@@ -45,30 +46,43 @@ def iterate_frames_batch(path: str, batch_size: int = 8, frame_skip: int = 2):
         path: Path to video file
         batch_size: Number of frames to process together
         frame_skip: Skip frames (1 = all frames, 2 = every 2nd frame, 3 = every 3rd frame, etc.)
+        decode_mode: How skipped frames are consumed:
+            'read' - cap.read() every frame (decode + retrieve, old behaviour)
+            'grab' - cap.grab() skipped frames, retrieve only frames that are analysed
+            'seek' - jump straight to the next analysed frame with CAP_PROP_POS_FRAMES
+                     when frame_skip >= seek_min_skip (the backend decodes from the
+                     previous keyframe), otherwise behaves like 'grab'
+        seek_min_skip: Minimum frame_skip for which seeking beats grabbing
         
     Yields:
         (batch_indices: List[int], batch_frames: List[np.ndarray]) tuples
     """
+    frame_skip = max(1, int(frame_skip))
     cap = cv2.VideoCapture(path)
     # Tối ưu: set buffer size để giảm CPU overhead
     cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Giảm buffer để tránh lag
+    use_seek = decode_mode == 'seek' and frame_skip >= max(2, seek_min_skip)
     
     try:
         frame_idx = 0
         batch = []
         batch_indices = []
-        skipped_count = 0
         
         while True:
-            ok, frame = cap.read()
+            # Apply frame skip - chỉ lấy frame khi frame_idx chia hết cho frame_skip
+            keep = frame_idx % frame_skip == 0
+            if keep or decode_mode == 'read':
+                ok, frame = cap.read()
+            else:
+                # grab() bỏ qua bước retrieve (convert màu + copy buffer) của frame không dùng
+                ok, frame = cap.grab(), None
             if not ok:
                 # Yield remaining batch if any
                 if batch:
                     yield batch_indices, batch
                 break
             
-            # Apply frame skip - chỉ lấy frame khi frame_idx chia hết cho frame_skip
-            if frame_idx % frame_skip == 0:
+            if keep:
                 batch.append(frame)
                 batch_indices.append(frame_idx)
                 
@@ -77,11 +91,88 @@ def iterate_frames_batch(path: str, batch_size: int = 8, frame_skip: int = 2):
                     yield batch_indices, batch
                     batch = []
                     batch_indices = []
-            else:
-                skipped_count += 1
+                
+                if use_seek:
+                    next_idx = frame_idx + frame_skip
+                    if cap.set(cv2.CAP_PROP_POS_FRAMES, next_idx):
+                        frame_idx = next_idx
+                        continue
+                    # Backend không seek được -> quay về grab
+                    use_seek = False
             
             frame_idx += 1
     finally:
         cap.release()
 
 
+def iterate_frame_ranges(path: str, ranges: List[Tuple[int, Optional[int]]], batch_size: int = 8,
+                         frame_skip: int = 2, decode_mode: str = 'grab', seek_min_skip: int = 60):
+    """
+    Iterate through the frames of a few frame ranges only (dense pass of a coarse-to-fine search)
+    
+    Args:
+        path: Path to video file
+        ranges: Sorted, non-overlapping [(start_frame, end_frame), ...], end inclusive;
+            end None = until the end of the video
+        batch_size: Number of frames to process together
+        frame_skip: Keep frames with frame_idx % frame_skip == 0 inside the ranges
+        decode_mode: 'read' decodes every frame up to the last range, 'grab'/'seek' grab
+            frames between ranges and seek to a range start when it is at least
+            seek_min_skip frames ahead; 'seek' also seeks inside a range like
+            iterate_frames_batch when frame_skip >= seek_min_skip
+        seek_min_skip: Minimum gap for which seeking beats grabbing
+        
+    Yields:
+        (batch_indices: List[int], batch_frames: List[np.ndarray]) tuples
+    """
+    frame_skip = max(1, int(frame_skip))
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    allow_seek = decode_mode != 'read'
+    use_seek = decode_mode == 'seek' and frame_skip >= max(2, seek_min_skip)
+
+    try:
+        frame_idx = 0
+        batch = []
+        batch_indices = []
+        for start, end in ranges:
+            start = max(0, int(start))
+            # Frame đầu tiên trong range nằm trên lưới frame_skip
+            start += (-start) % frame_skip
+            if end is not None and start > end:
+                continue
+            if allow_seek and start - frame_idx >= max(2, seek_min_skip):
+                if cap.set(cv2.CAP_PROP_POS_FRAMES, start):
+                    frame_idx = start
+                else:
+                    allow_seek = False  # Backend không seek được -> grab
+            ended = False
+            while end is None or frame_idx <= end:
+                keep = frame_idx >= start and frame_idx % frame_skip == 0
+                if keep or decode_mode == 'read':
+                    ok, frame = cap.read()
+                else:
+                    ok, frame = cap.grab(), None
+                if not ok:
+                    ended = True
+                    break
+                if keep:
+                    batch.append(frame)
+                    batch_indices.append(frame_idx)
+                    if len(batch) >= batch_size:
+                        yield batch_indices, batch
+                        batch = []
+                        batch_indices = []
+                    if use_seek and allow_seek:
+                        next_idx = frame_idx + frame_skip
+                        if cap.set(cv2.CAP_PROP_POS_FRAMES, next_idx):
+                            frame_idx = next_idx
+                            continue
+                        allow_seek = False
+                frame_idx += 1
+            if ended:
+                break
+        if batch:
+            yield batch_indices, batch
+    finally:
+        cap.release()
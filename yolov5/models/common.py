@@ -854,11 +854,12 @@ class AutoShape(nn.Module):
         return self
 
     @smart_inference_mode()
-    def forward(self, ims, size=640, augment=False, profile=False):
+    def forward(self, ims, size=640, augment=False, profile=False, raw=False):
         """
         Performs inference on inputs with optional augment & profiling.
 
-        Supports various formats including file, URI, OpenCV, PIL, numpy, torch.
+        Supports various formats including file, URI, OpenCV, PIL, numpy, torch. With `raw=True` the NMS output is
+        returned as a list of (n, 6) numpy arrays [xyxy, conf, cls] in original image pixels, skipping Detections.
         """
         # For size(height=640, width=1280), RGB images example inputs are:
         #   file:        ims = 'data/images/zidane.jpg'  # str or PosixPath
@@ -922,6 +923,8 @@ class AutoShape(nn.Module):
                 for i in range(n):
                     scale_boxes(shape1, y[i][:, :4], shape0[i])
 
+            if raw:
+                return [yi.float().cpu().numpy() for yi in y]  # lean path, no Detections/pandas
             return Detections(ims, y, files, dt, self.names, x.shape)
 
 